@@ -0,0 +1,398 @@
+"""
+Benchmarks for performance sensitive parts of Kupfer, can only be used
+when Kupfer is run from the Source directory.
+
+Run as ``python benchmark.py [name ...]`` to run the named benchmarks,
+or all of them if no name is given.
+"""
+
+from __future__ import with_statement
+
+import os
+import random
+import sys
+import time
+
+def timeit(func, repeat=3):
+	"""Return the best time in seconds of @repeat calls of @func"""
+	best = None
+	for i in xrange(repeat):
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def report(name, seconds, baseline=None):
+	speedup = " (%.1fx)" % (baseline/seconds, ) if baseline else ""
+	print "%-40s %8.2f ms%s" % (name, seconds*1000, speedup)
+
+def make_names(count, seed=0):
+	"""Return a list of @count synthetic unicode leaf names"""
+	rand = random.Random(seed)
+	words = [u"".join(rand.choice(u"abcdefghijklmnopqrstuvwxyz")
+	                  for i in xrange(rand.randint(2, 9)))
+	         for j in xrange(2000)]
+	seps = (u" ", u"-", u"_", u".")
+	names = []
+	for i in xrange(count):
+		nwords = rand.randint(1, 4)
+		name = rand.choice(seps).join(rand.choice(words)
+		                              for j in xrange(nwords))
+		names.append(name.title() if rand.random() < 0.3 else name)
+	return names
+
+class _NamedObject (object):
+	rank_adjust = 0
+	def __init__(self, name):
+		self.name = name
+	def __unicode__(self):
+		return self.name
+
+def bench_prefilter(count=40000):
+	"""Score a large catalog for a sequence of keystrokes"""
+	from kupfer.core import relevance, search
+
+	objects = [_NamedObject(n) for n in make_names(count)]
+	index = search.SearchIndex(objects)
+	queries = [u"t", u"te", u"ter", u"term", u"termi", u"qz", u"xkcd"]
+
+	def plain():
+		for q in queries:
+			for obj in objects:
+				relevance.score(obj.name, q)
+	def indexed():
+		for q in queries:
+			for rb in search.score_objects(index.rankables(), q):
+				pass
+	def batched():
+		for q in queries:
+			for rb in search.score_objects(index.rankables(key=q), q):
+				pass
+	def score_many():
+		for q in queries:
+			relevance.score_many(names, q)
+
+	names = [obj.name for obj in objects]
+	print "Scoring %d names for %d queries" % (count, len(queries))
+	base = timeit(plain)
+	report("relevance.score per name", base)
+	report("score_objects with SearchIndex", timeit(indexed), base)
+	report("score_objects with StringBatch", timeit(batched), base)
+	report("relevance.score_many, unprepared", timeit(score_many), base)
+
+def _walk_dirlist(folder, depth=0, exclude=None):
+	"""The os.walk based directory listing kupfer used before dircrawler"""
+	from os import path as os_path
+	paths = []
+	for dirname, dirnames, fnames in os.walk(folder):
+		dp = 0
+		head = dirname
+		while not os_path.samefile(head, folder):
+			head, tail = os_path.split(head)
+			dp += 1
+		if dp > depth:
+			del dirnames[:]
+			continue
+		excl_dir = []
+		for dir in dirnames:
+			if exclude and exclude(dir):
+				excl_dir.append(dir)
+				continue
+			paths.append(os_path.join(dirname, dir))
+		for file in fnames:
+			if exclude and exclude(file):
+				continue
+			paths.append(os_path.join(dirname, file))
+		for dir in reversed(excl_dir):
+			dirnames.remove(dir)
+	return paths
+
+def _make_tree(root, nfiles, fanout=10, per_dir=50):
+	"""Create a tree of about @nfiles empty files below @root"""
+	dirs = [root]
+	created = 0
+	while created < nfiles:
+		parent = dirs.pop(0)
+		for i in xrange(fanout):
+			path = os.path.join(parent, "dir%d" % i)
+			os.mkdir(path)
+			dirs.append(path)
+		for i in xrange(per_dir):
+			open(os.path.join(parent, "file%d.txt" % i), "w").close()
+		created += per_dir + fanout
+
+def bench_dircrawl(nfiles=100000, depth=3):
+	"""List a large directory tree like FileSource does"""
+	import shutil
+	import tempfile
+	from kupfer import dircrawler
+
+	def exclude(name):
+		return name.startswith(".")
+
+	root = tempfile.mkdtemp(prefix="kupfer-bench-")
+	try:
+		_make_tree(root, nfiles)
+		old = set(_walk_dirlist(root, depth, exclude))
+		new = set(dircrawler.crawl(root, depth, exclude=exclude))
+		assert old == new, "dircrawler lists different paths"
+		print "Listing %d paths to depth %d" % (len(new), depth)
+		base = timeit(lambda: _walk_dirlist(root, depth, exclude))
+		report("os.walk and samefile", base)
+		report("dircrawler, serial", timeit(lambda:
+			list(dircrawler.crawl(root, depth, exclude=exclude))), base)
+		workers = dircrawler.CRAWLER_WORKERS
+		report("dircrawler, %d threads" % workers, timeit(lambda:
+			list(dircrawler.crawl(root, depth, exclude=exclude,
+			                      workers=workers))), base)
+	finally:
+		shutil.rmtree(root)
+
+class _OrderedDictLruCache (object):
+	"""The OrderedDict based LruCache kupfer used before"""
+	def __init__(self, maxsiz):
+		from collections import OrderedDict
+		self.d = OrderedDict()
+		self.maxsiz = maxsiz
+	def __setitem__(self, key, value):
+		self.d.pop(key, None)
+		self.d[key] = value
+		if len(self.d) > self.maxsiz:
+			self.d.pop(next(iter(self.d)))
+	def __getitem__(self, key):
+		value = self.d.pop(key)
+		self.d[key] = value
+		return value
+
+def bench_lrucache(size=100, lookups=200000):
+	"""Look up icon-like keys in a LruCache, as the icon cache does"""
+	from kupfer import datatools
+
+	rand = random.Random(0)
+	keys = [("icon-%d" % rand.randint(0, 3 * size), 24)
+	        for i in xrange(lookups)]
+
+	def old_lookups():
+		cache = _OrderedDictLruCache(size)
+		for key in keys:
+			try:
+				cache[key]
+			except KeyError:
+				cache[key] = key
+	def new_lookups():
+		cache = datatools.LruCache(size)
+		for key in keys:
+			if cache.get(key) is None:
+				cache[key] = key
+
+	print "%d lookups in a cache of %d" % (lookups, size)
+	base = timeit(old_lookups)
+	report("OrderedDict, pop and reinsert", base)
+	report("LruCache, linked list", timeit(new_lookups), base)
+
+class _DictFileLeaf (object):
+	"""The __dict__ based layout FileLeaf had before, with an alias set"""
+	def __init__(self, obj):
+		from kupfer.kupferstring import tofolded
+		self.name = os.path.basename(obj).decode("UTF-8")
+		self.object = obj
+		self._content_source = None
+		folded = tofolded(self.name)
+		if folded != self.name:
+			self.name_aliases = set([folded])
+
+def _leaf_memory(leaves):
+	"""Return the bytes used by @leaves, their attribute storage and
+	their names, counting each shared name once"""
+	seen = set()
+	total = 0
+	for leaf in leaves:
+		total += sys.getsizeof(leaf)
+		if hasattr(leaf, "__dict__"):
+			total += sys.getsizeof(leaf.__dict__)
+		aliases = getattr(leaf, "name_aliases", None)
+		strings = [leaf.name]
+		if aliases is not None:
+			total += sys.getsizeof(aliases)
+			strings.extend(aliases)
+		for string in strings:
+			if id(string) not in seen:
+				seen.add(id(string))
+				total += sys.getsizeof(string)
+	return total
+
+def bench_leafmemory(count=50000):
+	"""Memory used by a large catalog of FileLeaf"""
+	from kupfer.obj.objects import FileLeaf
+
+	rand = random.Random(0)
+	dirnames = make_names(count // 20, seed=1)
+	basenames = make_names(count // 4, seed=2)
+	basenames[::10] = [n.replace(u"a", u"\xe4") for n in basenames[::10]]
+	paths = [os.path.join(rand.choice(dirnames), rand.choice(basenames))
+	         .encode("UTF-8") for i in xrange(count)]
+
+	old = [_DictFileLeaf(p) for p in paths]
+	new = [FileLeaf(p) for p in paths]
+	print "Memory of %d leaves" % count
+	for name, leaves in (("__dict__ and alias set", old),
+	                     ("FileLeaf, slots and interned names", new)):
+		print "%-40s %8.2f MiB" % (name, _leaf_memory(leaves)/1024.0/1024)
+
+def _fold_eagerly(ustr):
+	"""kupferstring.tofolded as it was, without the ASCII fast path"""
+	from unicodedata import normalize, category
+	from kupfer.kupferstring import folding_table
+	srcstr = normalize("NFKD", ustr.translate(folding_table))
+	return u"".join([c for c in srcstr if category(c) != 'Mn'])
+
+def bench_leafinit(count=50000):
+	"""Construct the leaves of a rescanned source"""
+	from kupfer.obj.base import Leaf
+
+	names = make_names(count)
+	names[::10] = [n.replace(u"e", u"\xe9") for n in names[::10]]
+
+	def eager():
+		for name in names:
+			leaf = Leaf(name, name)
+			leaf.kupfer_add_alias(_fold_eagerly(leaf.name))
+	def lazy():
+		for name in names:
+			Leaf(name, name)
+
+	print "Constructing %d leaves" % count
+	base = timeit(eager)
+	report("Leaf, folding in __init__", base)
+	report("Leaf, folding when indexed", timeit(lazy), base)
+
+def _make_file_sources(nsources, leaves_per_source):
+	"""Return @nsources Sources of FileLeaf, with their leaves loaded"""
+	from kupfer.obj.sources import FileSource
+	from kupfer.obj.objects import FileLeaf
+
+	names = make_names(nsources * leaves_per_source)
+	srcs = []
+	for i in xrange(nsources):
+		src = FileSource(["/bench/source%d" % i])
+		src.cached_items = [FileLeaf(os.path.join("/bench", n.encode("UTF-8")))
+		                    for n in names[i::nsources]]
+		srcs.append(src)
+	return srcs
+
+def bench_catalogrestore(nsources=40, leaves_per_source=2000):
+	"""Restore source caches at startup"""
+	import shutil
+	import tempfile
+	from kupfer import config
+	from kupfer.core import sources as core_sources
+
+	srcs = _make_file_sources(nsources, leaves_per_source)
+	cache_home = tempfile.mkdtemp(prefix="kupfer-bench-")
+	config.get_cache_home = lambda: cache_home
+	def restore(pickler_class, use_leaves):
+		pickler = pickler_class()
+		for src in srcs:
+			cached = pickler.unpickle_source(src)
+			if use_leaves:
+				list(cached.cached_items)
+	try:
+		for pickler_class in (core_sources.SourcePickler,
+		                      core_sources.CatalogPickler):
+			pickler = pickler_class()
+			for src in srcs:
+				pickler.pickle_source(src)
+			pickler.finish()
+		print "Restoring %d sources of %d leaves" % (nsources,
+		                                             leaves_per_source)
+		base = timeit(lambda: restore(core_sources.SourcePickler, True))
+		report("gzip pickle per source", base)
+		report("catalog file, all leaves used", timeit(lambda:
+			restore(core_sources.CatalogPickler, True)), base)
+		report("catalog file, no leaves used", timeit(lambda:
+			restore(core_sources.CatalogPickler, False)), base)
+	finally:
+		shutil.rmtree(cache_home)
+
+def _gzip_codec(level=3):
+	"""The gzip file format source caches were saved in before"""
+	import gzip
+	import StringIO
+	from kupfer.core import cachecodec
+
+	class GzipCodec (cachecodec.Codec):
+		name = "gzip-%d (before)" % level
+		tag = "g"
+		def compress(self, data):
+			output = StringIO.StringIO()
+			gzfile = gzip.GzipFile(fileobj=output, mode="wb",
+			                       compresslevel=level)
+			gzfile.write(data)
+			gzfile.close()
+			return output.getvalue()
+		def decompress(self, data):
+			return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+	return GzipCodec()
+
+def bench_cachecodec(sizes=(10, 500, 10000), nsources=10):
+	"""Save and load source caches with each cache codec"""
+	import cPickle as pickle
+	import shutil
+	import tempfile
+	from kupfer.core import cachecodec
+
+	codecs = [_gzip_codec(), cachecodec.RawCodec()]
+	codecs.extend(cachecodec.ZlibCodec(level) for level in (1, 3, 6, 9))
+	if "lz4" in cachecodec.get_codec_names():
+		codecs.append(cachecodec.Lz4Codec())
+	# (name, encode, decode)
+	variants = [(codec.name, codec.compress, codec.decompress)
+	            for codec in codecs]
+	variants.append(("auto, by size", cachecodec.CodecPolicy().encode,
+	                 cachecodec.decode))
+
+	cache_home = tempfile.mkdtemp(prefix="kupfer-bench-")
+	try:
+		for size in sizes:
+			srcs = _make_file_sources(nsources, size)
+			filenames = [os.path.join(cache_home, "source%d" % i)
+			             for i in xrange(nsources)]
+			def save(encode):
+				for src, filename in zip(srcs, filenames):
+					data = pickle.dumps(src, pickle.HIGHEST_PROTOCOL)
+					with open(filename, "wb") as output:
+						output.write(encode(data))
+			def load(decode):
+				for filename in filenames:
+					with open(filename, "rb") as fobj:
+						pickle.loads(decode(fobj.read()))
+			print "%d sources of %d leaves" % (nsources, size)
+			print "%-40s %11s %11s %9s" % ("", "save", "load", "size")
+			for name, encode, decode in variants:
+				save_time = timeit(lambda: save(encode))
+				load_time = timeit(lambda: load(decode))
+				disk = sum(os.path.getsize(f) for f in filenames)
+				print "%-40s %8.2f ms %8.2f ms %6d KiB" % (name,
+						save_time*1000, load_time*1000, disk // 1024)
+	finally:
+		shutil.rmtree(cache_home)
+
+benchmarks = {
+	"prefilter": bench_prefilter,
+	"dircrawl": bench_dircrawl,
+	"lrucache": bench_lrucache,
+	"leafmemory": bench_leafmemory,
+	"leafinit": bench_leafinit,
+	"catalogrestore": bench_catalogrestore,
+	"cachecodec": bench_cachecodec,
+}
+
+def main(names):
+	for name in (names or sorted(benchmarks)):
+		print "==", name
+		benchmarks[name]()
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
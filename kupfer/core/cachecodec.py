@@ -0,0 +1,163 @@
+"""
+Codecs for compressing cache records.
+
+The codec of a record is chosen by its size: small records are stored
+as they are, larger ones are compressed. Compressed records start with
+a header naming their codec, so they can be decoded without knowing
+how they were saved. Records without the header are raw; pickles never
+start with the header, so plain pickles saved before can still be read.
+
+This module is a part of the program Kupfer, see the main program file for
+more information.
+"""
+
+import zlib
+
+from kupfer import pretty
+
+try:
+	from lz4.block import compress as lz4_compress
+	from lz4.block import decompress as lz4_decompress
+except ImportError:
+	lz4_compress = lz4_decompress = None
+
+HEADER = "\0kc"
+
+# records smaller than this (bytes) are not compressed
+RAW_LIMIT = 16 * 1024
+# zlib compression level, 1 (fastest) to 9 (smallest)
+COMPRESS_LEVEL = 3
+
+class Codec (object):
+	"""Compresses records; @tag marks records compressed by this codec"""
+	name = None
+	tag = None
+	def compress(self, data):
+		raise NotImplementedError
+	def decompress(self, data):
+		raise NotImplementedError
+	def __repr__(self):
+		return "<%s %s>" % (type(self).__name__, self.name)
+
+class RawCodec (Codec):
+	name = "raw"
+	tag = ""
+	def compress(self, data):
+		return data
+	def decompress(self, data):
+		return data
+
+class ZlibCodec (Codec):
+	tag = "z"
+	def __init__(self, level=COMPRESS_LEVEL):
+		self.level = level
+		self.name = "zlib-%d" % level
+	def compress(self, data):
+		return zlib.compress(data, self.level)
+	def decompress(self, data):
+		return zlib.decompress(data)
+
+class Lz4Codec (Codec):
+	"""Much faster than zlib, but compresses less; needs python-lz4"""
+	name = "lz4"
+	tag = "l"
+	def compress(self, data):
+		return lz4_compress(data)
+	def decompress(self, data):
+		return lz4_decompress(data)
+
+# tag -> codec able to decompress its records
+_decoders = {
+	ZlibCodec.tag: ZlibCodec(),
+}
+if lz4_compress is not None:
+	_decoders[Lz4Codec.tag] = Lz4Codec()
+
+def get_codec_names():
+	"""Return the names of the codecs that can be used"""
+	names = ["auto", "raw", "zlib"]
+	if Lz4Codec.tag in _decoders:
+		names.append("lz4")
+	return names
+
+def encode(data, codec):
+	"""Return the record of @data compressed with @codec
+
+	>>> encode("data", RawCodec())
+	'data'
+	>>> decode(encode("data" * 100, ZlibCodec())) == "data" * 100
+	True
+	"""
+	if not codec.tag:
+		return data
+	return HEADER + codec.tag + codec.compress(data)
+
+def decode(record):
+	"""Return the data of @record, compressed with any codec
+
+	Raise ValueError if the codec is not available.
+
+	>>> decode("raw data")
+	'raw data'
+	>>> decode(HEADER + "?")
+	Traceback (most recent call last):
+	    ...
+	ValueError: Unknown cache codec '?'
+	"""
+	if not record.startswith(HEADER):
+		return record
+	tag = record[len(HEADER):len(HEADER)+1]
+	try:
+		codec = _decoders[tag]
+	except KeyError:
+		raise ValueError("Unknown cache codec %r" % tag)
+	try:
+		return codec.decompress(record[len(HEADER)+1:])
+	except Exception, exc:
+		raise ValueError("Invalid %s record: %s" % (codec.name, exc))
+
+class CodecPolicy (pretty.OutputMixin):
+	"""
+	Choose the codec of each record by its size
+
+	@codec: "auto" to store records smaller than @raw_limit bytes raw
+	and compress larger ones (with lz4 if available), or one of
+	"raw", "zlib" and "lz4" for all records
+	@level: zlib compression level
+
+	>>> policy = CodecPolicy(raw_limit=100)
+	>>> policy.choose(10)
+	<RawCodec raw>
+	>>> policy.choose(1000) is not policy.raw
+	True
+	>>> CodecPolicy("zlib", level=1).choose(10)
+	<ZlibCodec zlib-1>
+	"""
+	def __init__(self, codec="auto", level=COMPRESS_LEVEL, raw_limit=RAW_LIMIT):
+		self.raw = RawCodec()
+		self.raw_limit = raw_limit
+		if codec not in get_codec_names():
+			self.output_info("Cache codec %s not available, using auto" % codec)
+			codec = "auto"
+		if codec == "raw":
+			self.compressed = self.raw
+		elif codec == "zlib" or (codec == "auto" and
+		                         Lz4Codec.tag not in _decoders):
+			self.compressed = ZlibCodec(level)
+		else:
+			self.compressed = _decoders[Lz4Codec.tag]
+		self.always_compress = (codec != "auto")
+
+	def choose(self, size):
+		"""Return the codec for a record of @size bytes"""
+		if size < self.raw_limit and not self.always_compress:
+			return self.raw
+		return self.compressed
+
+	def encode(self, data):
+		"""Return the record of @data"""
+		return encode(data, self.choose(len(data)))
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
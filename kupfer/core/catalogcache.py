@@ -0,0 +1,198 @@
+"""
+A cache of the catalog in one file.
+
+Each source is stored as two records: the pickled source without its
+leaves, and its pickled leaves. An index at the start of the file lists
+the records with the time they were saved, so looking up a source does
+not read the other sources. The file is memory-mapped when first used.
+
+This module is a part of the program Kupfer, see the main program file for
+more information.
+"""
+
+import marshal
+import mmap
+import os
+import struct
+import threading
+import time
+
+from kupfer import datatools
+from kupfer import pretty
+
+MAGIC = "KUPCAT01"
+_HEADER = struct.Struct("<8sI")
+
+# entries that were not saved again for this long (seconds) are removed
+CATALOG_MAX_AGE = 30 * 86400
+
+class LazyLeaves (datatools.SavedIterable):
+	"""
+	Leaves that are unpickled from the string @record with @loads when
+	first iterated
+
+	Until then, @record can be saved again as it is.
+
+	>>> import pickle
+	>>> leaves = LazyLeaves(pickle.dumps([1, 2]), pickle.loads)
+	>>> leaves.record is not None
+	True
+	>>> list(leaves)
+	[1, 2]
+	>>> leaves.record is None
+	True
+	"""
+	def __new__(cls, record, loads):
+		return object.__new__(cls)
+	def __init__(self, record, loads):
+		datatools.SavedIterable.__init__(self, ())
+		self.record = record
+		self.loads = loads
+	def __iter__(self):
+		if self.record is not None:
+			# unpickle all at once, it is much faster than one by one
+			self.data = self.loads(self.record)
+			self.iterator = None
+			self.record = None
+		return iter(self.data)
+
+class CatalogCache (pretty.OutputMixin):
+	"""
+	Records of sources saved in the file @filename, keyed by strings
+
+	Entries are tuples of (source record, leaves record, time saved).
+	Entries that are not put again are kept when saving, unless they
+	are older than @max_age seconds.
+
+	>>> import tempfile
+	>>> filename = tempfile.mktemp()
+	>>> cache = CatalogCache(filename)
+	>>> cache.put("src", "source", "leaves")
+	>>> cache.save()
+	>>> cache = CatalogCache(filename)
+	>>> cache.get("src")[:2]
+	('source', 'leaves')
+	>>> cache.get_saved_time("src") <= time.time()
+	True
+	>>> cache.get("other") is None
+	True
+	>>> os.unlink(filename)
+	"""
+	def __init__(self, filename, max_age=CATALOG_MAX_AGE):
+		self.filename = filename
+		self.max_age = max_age
+		# key -> (offset, source length, leaves length, time saved)
+		self._index = None
+		self._map = None
+		self._data_start = 0
+		self._load_lock = threading.Lock()
+		# key -> entry, the entries to save
+		self._new = {}
+
+	def _load(self):
+		with self._load_lock:
+			if self._index is None:
+				self._index = self._read_index()
+
+	def _read_index(self):
+		try:
+			with open(self.filename, "rb") as fobj:
+				fmap = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+		except (EnvironmentError, ValueError):
+			# missing or empty file
+			return {}
+		try:
+			magic, index_len = _HEADER.unpack(fmap[:_HEADER.size])
+			if magic != MAGIC:
+				raise ValueError("Not a catalog cache")
+			index = marshal.loads(fmap[_HEADER.size:_HEADER.size + index_len])
+			if not isinstance(index, dict):
+				raise ValueError("Invalid index")
+		except (struct.error, ValueError, EOFError, TypeError), exc:
+			self.output_info("Ignoring %s: %s" % (self.filename, exc))
+			fmap.close()
+			return {}
+		self._map = fmap
+		self._data_start = _HEADER.size + index_len
+		self.output_debug("Loaded index of %d sources" % len(index))
+		return index
+
+	def get_saved_time(self, key):
+		"""Return the time the entry for @key was saved, or None"""
+		if key in self._new:
+			return self._new[key][2]
+		if self._index is None:
+			self._load()
+		try:
+			return self._index[key][3]
+		except KeyError:
+			return None
+
+	def get(self, key):
+		"""Return the entry for @key, or None"""
+		try:
+			return self._new[key]
+		except KeyError:
+			pass
+		if self._index is None:
+			self._load()
+		try:
+			offset, source_len, leaves_len, saved = self._index[key]
+		except KeyError:
+			return None
+		start = self._data_start + offset
+		middle = start + source_len
+		return (self._map[start:middle], self._map[middle:middle+leaves_len],
+		        saved)
+
+	def put(self, key, source_record, leaves_record):
+		"""Store an entry for @key"""
+		self._new[key] = (source_record, leaves_record, time.time())
+
+	def _entries_to_save(self):
+		"""Yield (key, entry) of the entries to save"""
+		for key, entry in self._new.iteritems():
+			yield key, entry
+		oldest = time.time() - self.max_age
+		for key in self._index or ():
+			if key not in self._new and self._index[key][3] >= oldest:
+				yield key, self.get(key)
+
+	def save(self):
+		"""Write the cache file, if any entries were put"""
+		if not self._new:
+			return
+		if self._index is None:
+			self._load()
+		index = {}
+		chunks = []
+		offset = 0
+		for key, (source_record, leaves_record, saved) in \
+				self._entries_to_save():
+			index[key] = (offset, len(source_record), len(leaves_record),
+			              saved)
+			chunks.append(source_record)
+			chunks.append(leaves_record)
+			offset += len(source_record) + len(leaves_record)
+		index_data = marshal.dumps(index)
+		tmp_filename = "%s.%s" % (self.filename, os.getpid())
+		try:
+			with open(tmp_filename, "wb") as output:
+				output.write(_HEADER.pack(MAGIC, len(index_data)))
+				output.write(index_data)
+				for chunk in chunks:
+					output.write(chunk)
+			os.rename(tmp_filename, self.filename)
+		except EnvironmentError, exc:
+			self.output_error("Saving %s: %s" % (self.filename, exc))
+			return
+		self.output_debug("Saved %d sources" % len(index))
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+		self._index = None
+		self._new.clear()
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -8,7 +8,7 @@ import sys
 import gobject
 gobject.threads_init()
 
-from kupfer.obj import base, sources, compose
+from kupfer.obj import base, sources, compose, validity
 from kupfer import pretty, scheduler
 from kupfer import datatools
 from kupfer.core import actioncompat
@@ -30,6 +30,10 @@ SourceActionMode, SourceActionObjectMode = (1,2)
 
 DATA_SAVE_INTERVAL_S = 3660
 
+# number of top search results to select before sorting the rest,
+# and to check for validity at once
+SEARCH_FIRST_RESULTS = 25
+
 def identity(x):
 	return x
 
@@ -60,12 +64,35 @@ class Searcher (object):
 	stores searches in a cache for a very limited time (*)
 
 	(*) As of this writing, the cache is used when the old key
-	is a prefix of the search key.
+	is a prefix of the search key: only the objects that matched
+	the old key are scored again, as long as their source has the
+	same leaves. A short stack of previous keys is kept, so that
+	erasing characters is cheap too.
 	"""
+	# number of previous keys to keep matches for
+	max_stack_depth = 10
 
 	def __init__(self):
-		self._source_cache = {}
-		self._old_key = None
+		# stack of (key, {source: matching IndexEntries}) by key length
+		self._match_stack = []
+
+	def _push_key(self, key):
+		"""Register a search for @key
+
+		Return (previous, current), the match dicts of the longest previous
+		key that is a prefix of @key, and a new dict to store matches for @key
+		"""
+		stack = self._match_stack
+		while stack and not key.startswith(stack[-1][0]):
+			stack.pop()
+		previous = stack[-1][1] if stack else {}
+		if stack and stack[-1][0] == key:
+			stack.pop()
+		current = {}
+		if key:
+			stack.append((key, current))
+			del stack[:-self.max_stack_depth]
+		return previous, current
 
 	def search(self, sources, key, score=True, item_check=None, decorator=None):
 		"""
@@ -80,35 +107,31 @@ class Searcher (object):
 		Return (first, match_iter), where first is the first match,
 		and match_iter an iterator to all matches, including the first match.
 		"""
-		if not self._old_key or not key.startswith(self._old_key):
-			self._source_cache.clear()
-		self._old_key = key
+		previous_matches, key_matches = self._push_key(key)
 
+		# indexed sources are filtered lazily, skip the identity filter
+		index_check = item_check
 		if not item_check: item_check = identity
 		if not decorator: decorator = identity
 
 		match_iters = []
 		for src in sources:
 			fixedrank = 0
-			can_cache = True
-			rankables = None
 			if is_iterable(src):
 				items = item_check(src)
-				can_cache = False
 			else:
-				# Look in source cache for stored rankables
 				try:
-					rankables = self._source_cache[src]
-				except KeyError:
-					try:
-						items = item_check(src.get_text_items(key))
-						fixedrank = src.get_rank()
-						can_cache = False
-					except AttributeError:
-						items = item_check(src.get_leaves())
-
-			if not rankables:
-				rankables = search.make_rankables(items)
+					items = item_check(src.get_text_items(key))
+					fixedrank = src.get_rank()
+				except AttributeError:
+					# the matches of sources are kept per leaf source
+					for leaf_src in search.get_leaf_sources(src):
+						match_iters.append(self._search_source(leaf_src, key,
+								score, index_check, previous_matches,
+								key_matches))
+					continue
+
+			rankables = search.make_rankables(items)
 
 			if score:
 				if fixedrank:
@@ -116,9 +139,6 @@ class Searcher (object):
 				elif key:
 					rankables = search.score_objects(rankables, key)
 				matches = search.bonus_objects(rankables, key)
-				if can_cache:
-					# we fork off a copy of the iterator to save
-					matches, self._source_cache[src] = itertools.tee(matches)
 			else:
 				# we only want to list them
 				matches = rankables
@@ -127,19 +147,26 @@ class Searcher (object):
 		
 		matches = itertools.chain(*match_iters)
 		if score:
-			matches = sorted(matches, key=operator.attrgetter("rank"),
-					reverse=True)
+			matches = datatools.largest_first(matches,
+					key=operator.attrgetter("rank"), batch=SEARCH_FIRST_RESULTS)
 
 		def as_set_iter(seq):
 			key = operator.attrgetter("object")
 			return datatools.UniqueIterator(seq, key=key)
 
 		def valid_check(seq):
-			"""yield items of @seq that are valid"""
-			for itm in seq:
-				obj = itm.object
-				if (not hasattr(obj, "is_valid")) or obj.is_valid():
+			"""yield items of @seq that are valid, checking them a page
+			at a time once the first valid item is yielded"""
+			seq = iter(seq)
+			page_size = 1
+			while True:
+				page = list(itertools.islice(seq, page_size))
+				if not page:
+					break
+				for itm in validity.filter_valid(page,
+						key=operator.attrgetter("object")):
 					yield itm
+					page_size = SEARCH_FIRST_RESULTS
 
 		# Check if the items are valid as the search
 		# results are accessed through the iterators
@@ -147,6 +174,29 @@ class Searcher (object):
 		match, match_iter = peekfirst(decorator(valid_check(unique_matches)))
 		return match, match_iter
 
+	def _search_source(self, src, key, score, item_check, previous_matches,
+	                   key_matches):
+		"""Return the matches of Source @src, which has no leaf sources
+
+		Only the objects that matched a shorter key are scored, if they
+		are recorded in @previous_matches; the matches are recorded
+		in @key_matches.
+		"""
+		entries = search.get_recorded_entries(previous_matches, src)
+		if entries is not None:
+			rankables = search.entry_rankables(entries, item_check)
+		else:
+			rankables = search.source_rankables(src, item_check,
+					key if score else None)
+		if not score:
+			return rankables
+		if key:
+			rankables = search.score_objects(rankables, key)
+			# dynamic sources are read again every time
+			if not src.is_dynamic():
+				rankables = search.record_entries(rankables, key_matches, src)
+		return search.bonus_objects(rankables, key)
+
 	def rank_actions(self, objects, key, leaf, item_check=None, decorator=None):
 		"""
 		rank @objects, which should be a sequence of KupferObjects,
@@ -513,7 +563,7 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 		sc = GetSourceController()
 		sc.add(None, D_s, toplevel=True)
 		sc.add(None, d_s, toplevel=False)
-		sc.initialize()
+		sc.initialize(self._reload_source_root)
 		learn.load()
 
 	def _display(self, sched):
@@ -748,16 +798,13 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 		This will trigger .select() with None if items
 		are not valid..
 		"""
-		def valid_check(obj):
-			return not (hasattr(obj, "is_valid") and not obj.is_valid())
-
 		for pane, panectl in self._panectl_table.items():
 			sel = panectl.get_selection()
-			if not valid_check(sel):
+			if not validity.is_valid(sel):
 				self.emit("pane-reset", pane, None)
 				self.select(pane, None)
 			if self._has_object_stack(pane):
-				new_stack = [o for o in panectl.object_stack if valid_check(o)]
+				new_stack = validity.filter_valid(panectl.object_stack)
 				if new_stack != panectl.object_stack:
 					self._set_object_stack(pane, new_stack)
 
@@ -1,13 +1,33 @@
+from __future__ import with_statement
+
+from bisect import bisect_left
 import cPickle as pickle
+import heapq
+import marshal
+import math
 import os
+import time
 
 from kupfer import config
 from kupfer import conspickle
 from kupfer import pretty
 
 mnemonics_filename = "mnemonics.pickle"
+snapshot_filename = "mnemonics.snapshot"
+journal_filename = "mnemonics.journal"
 CORRELATION_KEY = 'kupfer.bonus.correlation'
 
+SNAPSHOT_MAGIC = "kupfer-mnemonics"
+SNAPSHOT_VERSION = 2
+# the frecency of an object halves in this time (seconds)
+FRECENCY_HALF_LIFE = 30 * 86400
+_decay_rate = math.log(2) / FRECENCY_HALF_LIFE
+# number of journal records to collect before writing a new snapshot
+JOURNAL_COMPACT_SIZE = 2000
+
+# journal record types
+_HIT, _CORRELATION, _ERASE = ("hit", "corr", "erase")
+
 ## this is a harmless default
 _default_actions = {
 	'<builtin.AppLeaf gnome-terminal>': '<builtin.LaunchAgain>',
@@ -15,33 +35,97 @@ _default_actions = {
 }
 _register = {}
 _favorites = set()
+# id of the snapshot the journal continues, or None if there is none
+_snapshot_id = None
+# journal records not yet written, and the number already written
+_journal = []
+_journal_size = 0
+# False if the journal file is stale or truncated, and can not be
+# appended to
+_journal_intact = True
+# mnemonic -> set of names in the register that have the mnemonic
+_mnemonic_index = {}
+_sorted_mnemonic_index = []
+# heap of (frecency, name) to find the entries to evict, and
+# the configured maximum number of entries in the register
+_eviction_heap = []
+_register_budget = 500
+_use_frecency = False
+
+def _logaddexp(a, b):
+	"""Return log(exp(@a) + exp(@b)) without overflow"""
+	if a < b:
+		a, b = b, a
+	return a + math.log1p(math.exp(b - a))
+
+def _prefix_range(sorted_keys, prefix):
+	"""Return the keys in the sorted list @sorted_keys that start
+	with @prefix"""
+	start = end = bisect_left(sorted_keys, prefix)
+	for end in xrange(start, len(sorted_keys)):
+		if not sorted_keys[end].startswith(prefix):
+			break
+	else:
+		end = len(sorted_keys)
+	return sorted_keys[start:end]
 
 
 class Mnemonics (object):
 	"""
 	Class to describe a collection of mnemonics
 	as well as the total count
+
+	The frecency is the sum of exp(decay_rate * t) for the time t of
+	each hit, stored as its logarithm. It orders objects the same
+	at any time, and get_frecency() gives the decayed value now.
 	"""
+	# mnemonics in sorted order, computed when needed
+	_sorted_mnemonics = None
+	frecency = None
 	def __init__(self):
 		self.mnemonics = dict()
 		self.count = 0
 	def __repr__(self):
 		return "<%s %d %s>" % (self.__class__.__name__, self.count, "".join(["%s: %d, " % (m,c) for m,c in self.mnemonics.iteritems()]))
-	def increment(self, mnemonic=None):
+	def __getstate__(self):
+		state = dict(vars(self))
+		state.pop("_sorted_mnemonics", None)
+		return state
+	def increment(self, mnemonic=None, timestamp=None):
 		if mnemonic:
 			mcount = self.mnemonics.get(mnemonic, 0)
 			self.mnemonics[mnemonic] = mcount + 1
+			if not mcount:
+				self._sorted_mnemonics = None
 		self.count += 1
+		hit = _decay_rate * (timestamp or time.time())
+		if self.frecency is None:
+			self.frecency = hit
+		else:
+			self.frecency = _logaddexp(self.frecency, hit)
 
-	def decrement(self):
-		"""Decrement total count and the least mnemonic"""
-		if self.mnemonics:
-			key = min(self.mnemonics, key=lambda k: self.mnemonics[k])
-			if self.mnemonics[key] <= 1:
-				del self.mnemonics[key]
-			else:
-				self.mnemonics[key] -= 1
-		self.count = max(self.count -1, 0)
+	def get_frecency(self, now=None):
+		"""Return the time-decayed hit count at time @now"""
+		if self.frecency is None:
+			return self.count
+		return math.exp(self.frecency - _decay_rate * (now or time.time()))
+
+	def get_prefix_count(self, prefix):
+		"""Return the total count of mnemonics starting with @prefix"""
+		if self._sorted_mnemonics is None:
+			self._sorted_mnemonics = sorted(self.mnemonics)
+		stats = self.mnemonics
+		return sum(stats[m] for m in
+		           _prefix_range(self._sorted_mnemonics, prefix))
+
+	@classmethod
+	def from_record(cls, count, mnemonics, frecency=None):
+		"""Create Mnemonics from a snapshot record"""
+		mns = cls.__new__(cls)
+		mns.count = count
+		mns.mnemonics = mnemonics
+		mns.frecency = frecency
+		return mns
 
 	def __nonzero__(self):
 		return self.count
@@ -69,65 +153,227 @@ class Learning (object):
 		return data
 
 	@classmethod
-	def _pickle_register(self, reg, pickle_file):
+	def _load_snapshot(cls, snapshot_file):
+		"""Return (snapshot id, register) from @snapshot_file or None"""
+		try:
+			sfile = open(snapshot_file, "rb")
+		except IOError, e:
+			return None
+		try:
+			magic, version, snapshot_id, correlations, table = \
+					marshal.loads(sfile.read())
+			if magic != SNAPSHOT_MAGIC or version not in (1, SNAPSHOT_VERSION):
+				raise ValueError("Unknown format %r %r" % (magic, version))
+			pretty.print_debug(__name__, "Reading from %s" % (snapshot_file, ))
+		except Exception, e:
+			pretty.print_error(__name__, "Error loading %s: %s" %
+			                   (snapshot_file, e))
+			return None
+		finally:
+			sfile.close()
+		# version 1 rows have no frecency
+		reg = dict((row[0], Mnemonics.from_record(*row[1:])) for row in table)
+		reg[CORRELATION_KEY] = correlations
+		return snapshot_id, reg
+
+	@classmethod
+	def _write_snapshot(cls, snapshot_id, reg, snapshot_file):
+		table = [(name, mns.get_count(), mns.get_mnemonics(), mns.frecency)
+		         for name, mns in _get_mnemonic_items(reg)]
+		data = (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, snapshot_id,
+		        reg.get(CORRELATION_KEY, {}), table)
 		## Write to tmp then rename over for atomicity
-		tmp_pickle_file = "%s.%s" % (pickle_file, os.getpid())
-		pretty.print_debug(__name__, "Saving to %s" % (pickle_file, ))
-		with open(tmp_pickle_file, "wb") as output:
-			output.write(pickle.dumps(reg, pickle.HIGHEST_PROTOCOL))
-		os.rename(tmp_pickle_file, pickle_file)
+		tmp_snapshot_file = "%s.%s" % (snapshot_file, os.getpid())
+		pretty.print_debug(__name__, "Saving to %s" % (snapshot_file, ))
+		with open(tmp_snapshot_file, "wb") as output:
+			output.write(marshal.dumps(data))
+		os.rename(tmp_snapshot_file, snapshot_file)
+		return True
+
+	@classmethod
+	def _read_journal(cls, snapshot_id, journal_file):
+		"""Return (records, intact) of @journal_file
+
+		records is the list of records, if the journal continues the
+		snapshot @snapshot_id, and intact is False if the journal is
+		stale or ends in a partially written record.
+		"""
+		try:
+			jfile = open(journal_file, "rb")
+		except IOError, e:
+			return [], True
+		records = []
+		start = 0
+		with jfile:
+			try:
+				if marshal.load(jfile) != (SNAPSHOT_MAGIC, snapshot_id):
+					pretty.print_debug(__name__, "Ignoring stale journal")
+					return [], False
+				while True:
+					start = jfile.tell()
+					records.append(marshal.load(jfile))
+			except EOFError:
+				if start != os.fstat(jfile.fileno()).st_size:
+					pretty.print_debug(__name__, "Journal is truncated")
+					return records, False
+			except (ValueError, TypeError), e:
+				# a partially written record ends the journal
+				pretty.print_error(__name__, "Error loading %s: %s" %
+				                   (journal_file, e))
+				return records, False
+		return records, True
+
+	@classmethod
+	def _append_journal(cls, snapshot_id, records, journal_file):
+		with open(journal_file, "ab") as output:
+			if not output.tell():
+				marshal.dump((SNAPSHOT_MAGIC, snapshot_id), output)
+			for record in records:
+				marshal.dump(record, output)
 		return True
 
+def _apply_record(record):
+	"""Apply journal @record to the register"""
+	rtype = record[0]
+	if rtype == _HIT:
+		rtype, name, key, timestamp = record
+		if name not in _register:
+			_register[name] = Mnemonics()
+		mns = _register[name]
+		mns.increment(key, timestamp)
+		if key:
+			_add_to_mnemonic_index(name, key)
+		_push_eviction(name, mns)
+		_evict_to_budget()
+	elif rtype == _CORRELATION:
+		rtype, leaf_name, name = record
+		_register.setdefault(CORRELATION_KEY, {})[leaf_name] = name
+	elif rtype == _ERASE:
+		rtype, name = record
+		mns = _register.pop(name, None)
+		_register.get(CORRELATION_KEY, {}).pop(name, None)
+		if mns:
+			for mnemonic in mns.get_mnemonics():
+				_mnemonic_index.get(mnemonic, set()).discard(name)
+
+def _record(record):
+	"""Apply @record to the register and journal it"""
+	_apply_record(record)
+	_journal.append(record)
+
 def record_search_hit(obj, key=u""):
 	"""
 	Record that KupferObject @obj was used, with the optional
 	search term @key recording
 	"""
-	name = repr(obj)
-	if name not in _register:
-		_register[name] = Mnemonics()
-	_register[name].increment(key)
+	_record((_HIT, repr(obj), key, time.time()))
+
+def _add_to_mnemonic_index(name, mnemonic):
+	global _sorted_mnemonic_index
+	if mnemonic not in _mnemonic_index:
+		_mnemonic_index[mnemonic] = set()
+		_sorted_mnemonic_index = None
+	_mnemonic_index[mnemonic].add(name)
+
+def _rebuild_mnemonic_index():
+	global _sorted_mnemonic_index
+	_mnemonic_index.clear()
+	_sorted_mnemonic_index = None
+	for name, mns in _get_mnemonic_items(_register):
+		for mnemonic in mns.get_mnemonics():
+			_mnemonic_index.setdefault(mnemonic, set()).add(name)
+
+def _get_names_for_prefix(key):
+	"""Return the set of names that have a mnemonic starting with @key"""
+	global _sorted_mnemonic_index
+	if _sorted_mnemonic_index is None:
+		_sorted_mnemonic_index = sorted(_mnemonic_index)
+	names = set()
+	for mnemonic in _prefix_range(_sorted_mnemonic_index, key):
+		names.update(_mnemonic_index[mnemonic])
+	return names
 
 def get_record_score(obj, key=u""):
 	"""
 	Get total score for KupferObject @obj,
 	bonus score is given for @key matches
 	"""
-	name = repr(obj)
+	return get_name_score(repr(obj), key)
+
+def get_name_score(name, key=u""):
+	"""
+	Get total score for the object whose repr is @name,
+	bonus score is given for @key matches
+	"""
 	fav = 7 * (name in _favorites)
 	if name not in _register:
 		return fav
 	mns = _register[name]
 	if not key:
-		cnt = mns.get_count()
+		if _use_frecency:
+			cnt = mns.get_frecency()
+		else:
+			cnt = mns.get_count()
 		return fav + 50 * (1 - 1.0/(cnt + 1))
 
 	stats = mns.get_mnemonics()
-	closescr = sum(stats[m] for m in stats if m.startswith(key))
+	closescr = mns.get_prefix_count(key)
 	mnscore = 30 * (1 - 1.0/(closescr + 1))
 	exact = stats.get(key, 0)
 	mnscore += 50 * (1 - 1.0/(exact + 1))
 	return fav + mnscore
 
+def get_record_scorer(key=u""):
+	"""
+	Return a function that returns get_name_score(name, @key)
+	for the repr of an object, which is faster when scoring many
+	objects: only objects with mnemonics for @key are looked up
+	in the register.
+	"""
+	if not key:
+		return get_name_score
+	names = _get_names_for_prefix(key)
+	def record_scorer(name):
+		if name in names:
+			return get_name_score(name, key)
+		return 7 * (name in _favorites)
+	return record_scorer
+
 
 def get_correlation_bonus(obj, for_leaf):
 	"""
 	Get the bonus rank for @obj when used with @for_leaf
 	"""
-	if _register.setdefault(CORRELATION_KEY, {}).get(repr(for_leaf)) == repr(obj):
+	if get_correlated_name(for_leaf) == repr(obj):
 		return 50
 	else:
 		return 0
 
+def get_correlated_name(for_leaf):
+	"""
+	Return the repr of the object that gets a correlation bonus
+	when used with @for_leaf, or None
+	"""
+	return _register.setdefault(CORRELATION_KEY, {}).get(repr(for_leaf))
+
 def set_correlation(obj, for_leaf):
 	"""
 	Register @obj to get a bonus when used with @for_leaf
 	"""
-	_register.setdefault(CORRELATION_KEY, {})[repr(for_leaf)] = repr(obj)
+	_record((_CORRELATION, repr(for_leaf), repr(obj)))
 
 def _get_mnemonic_items(in_register):
 	return [(k,v) for k,v in in_register.items() if k != CORRELATION_KEY]
 
+def get_frequent_names(min_frecency):
+	"""
+	Return the set of reprs of the objects whose time-decayed
+	hit count is at least @min_frecency
+	"""
+	now = time.time()
+	return set(name for name, mns in _get_mnemonic_items(_register)
+	           if mns.get_frecency(now) >= min_frecency)
+
 def get_object_has_affinity(obj):
 	"""
 	Return if @obj has any positive score in the register
@@ -139,63 +385,128 @@ def erase_object_affinity(obj):
 	"""
 	Remove all track of affinity for @obj
 	"""
-	_register.pop(repr(obj), None)
-	_register.get(CORRELATION_KEY, {}).pop(repr(obj), None)
+	_record((_ERASE, repr(obj)))
 
-def _prune_register():
-	"""
-	Remove items with chance (len/25000)
+def _push_eviction(name, mns):
+	"""Register the current frecency of @name for eviction"""
+	heapq.heappush(_eviction_heap, (mns.frecency, name))
+	# drop outdated entries when they dominate the heap
+	if len(_eviction_heap) > 2 * len(_register) + 100:
+		_rebuild_eviction_heap()
 
-	Assuming homogenous records (all with score one) we keep:
-	x_n+1 := x_n * (1 - chance)
+def _rebuild_eviction_heap():
+	_eviction_heap[:] = [(mns.frecency, name) for name, mns in
+	                     _get_mnemonic_items(_register)]
+	heapq.heapify(_eviction_heap)
 
-	To this we have to add the expected number of added mnemonics per
-	invocation, est. 10, and we can estimate a target number of saved mnemonics.
+def _evict_to_budget():
 	"""
-	import random
-	random.seed()
-	rand = random.random
-
-	goalitems = 500
-	flux = 2.0
-	alpha = flux/goalitems**2
-
-	chance = min(0.1, len(_register)*alpha)
-	for leaf, mn in _get_mnemonic_items(_register):
-		if rand() > chance:
+	Remove the objects with the lowest frecency until the register
+	has at most _register_budget objects
+	"""
+	# the register also holds the correlations
+	while len(_register) - 1 > _register_budget and _eviction_heap:
+		frecency, name = heapq.heappop(_eviction_heap)
+		mns = _register.get(name)
+		# skip outdated heap entries
+		if name == CORRELATION_KEY or not mns or mns.frecency != frecency:
 			continue
-		mn.decrement()
-		if not mn:
-			del _register[leaf]
+		del _register[name]
+		for mnemonic in mns.get_mnemonics():
+			_mnemonic_index.get(mnemonic, set()).discard(name)
 
-	l = len(_register)
-	pretty.print_debug(__name__, "Pruned register (%d mnemonics)" % l)
+def _read_settings():
+	global _register_budget, _use_frecency
+	from kupfer.core import settings
+	setctl = settings.GetSettingsController()
+	_register_budget = setctl.get_config("Learning", "registersize")
+	_use_frecency = setctl.get_config("Learning", "frecency")
 
 def load():
 	"""
 	Load learning database
+
+	The database is the latest snapshot, followed by the journal
+	of the changes since then.
 	"""
-	global _register
+	global _register, _snapshot_id, _journal_size, _journal_intact
 
-	filepath = config.get_config_file(mnemonics_filename)
+	_register = {}
+	_snapshot_id = None
+	snapshot = None
+	filepath = config.get_config_file(snapshot_filename)
 	if filepath:
-		_register = Learning._unpickle_register(filepath)
+		snapshot = Learning._load_snapshot(filepath)
+	if snapshot:
+		_snapshot_id, _register = snapshot
+	else:
+		# Read the register in the old format
+		filepath = config.get_config_file(mnemonics_filename)
+		if filepath:
+			_register = Learning._unpickle_register(filepath)
 	if not _register:
 		_register = {}
 	if CORRELATION_KEY not in _register:
 		_register[CORRELATION_KEY] = _default_actions
+	# Older registers have no record of hit times,
+	# count the hits as happening now
+	now = time.time()
+	for name, mns in _get_mnemonic_items(_register):
+		if mns.frecency is None:
+			mns.frecency = (_decay_rate * now +
+			                math.log(max(mns.get_count(), 1)))
+	_read_settings()
+	_rebuild_mnemonic_index()
+	_rebuild_eviction_heap()
+
+	del _journal[:]
+	_journal_size = 0
+	_journal_intact = True
+	filepath = config.get_config_file(journal_filename)
+	if filepath and _snapshot_id is not None:
+		records, _journal_intact = \
+				Learning._read_journal(_snapshot_id, filepath)
+		for record in records:
+			_apply_record(record)
+		_journal_size = len(records)
+		pretty.print_debug(__name__, "Read %d journal records" % _journal_size)
 
 def save():
 	"""
 	Save the learning record
+
+	Append new changes to the journal, or write a
+	new snapshot if the journal is long enough.
 	"""
+	global _journal_size
 	if not _register:
 		pretty.print_debug(__name__, "Not writing empty register")
 		return
-	if len(_register) > 100:
-		_prune_register()
-	filepath = config.save_config_file(mnemonics_filename)
-	Learning._pickle_register(_register, filepath)
+	if (_snapshot_id is None or not _journal_intact or
+	    _journal_size + len(_journal) > JOURNAL_COMPACT_SIZE):
+		# records appended to a stale or truncated journal
+		# would not be read, so start a new one
+		_compact()
+	elif _journal:
+		filepath = config.save_config_file(journal_filename)
+		Learning._append_journal(_snapshot_id, _journal, filepath)
+		_journal_size += len(_journal)
+		del _journal[:]
+
+def _compact():
+	"""Write a new snapshot of the register and start a new journal"""
+	global _snapshot_id, _journal_size, _journal_intact
+	_evict_to_budget()
+	snapshot_id = time.time()
+	filepath = config.save_config_file(snapshot_filename)
+	Learning._write_snapshot(snapshot_id, _register, filepath)
+	_snapshot_id = snapshot_id
+	journalpath = config.get_config_file(journal_filename)
+	if journalpath:
+		os.unlink(journalpath)
+	del _journal[:]
+	_journal_size = 0
+	_journal_intact = True
 
 def add_favorite(obj):
 	_favorites.add(repr(obj))
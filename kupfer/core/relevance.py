@@ -33,6 +33,10 @@ Compatibility: Python 2.4 and later, including Python 3
 
 from __future__ import division
 
+from array import array
+from bisect import bisect_left, bisect_right
+import re
+
 # This module is compatible with both Python 2 and Python 3;
 # we need the iterator form of range for either version, stored in range()
 try:
@@ -40,6 +44,13 @@ try:
 except NameError:
     pass
 
+# number of (string, query) pairs to remember match spans for
+MATCH_SPANS_CACHE_SIZE = 100
+
+# Memo of findMatchSpans results, for redrawing highlighted strings;
+# a plain dict, emptied when full, so that the module stays standalone
+_match_spans_cache = {}
+
 def formatCommonSubstrings(s, query, format_clean=None, format_match=None):
     """
     Creates a new string highlighting matching substrings.
@@ -53,40 +64,137 @@ def formatCommonSubstrings(s, query, format_clean=None, format_match=None):
     >>> formatCommonSubstrings('parallelism', 'lsm', format_match=str.upper)
     'paralleLiSM'
     """
+    return formatSpans(s, findMatchSpans(s, query), format_clean, format_match)
+
+def formatSpans(s, spans, format_clean=None, format_match=None):
+    """
+    Format @s with the (start, end) @spans formatted by @format_match
+    and the rest by @format_clean
+
+    >>> formatSpans('hi there dude', [(0, 2), (9, 13)], format_match=str.upper)
+    'HI there DUDE'
+    """
     format_clean = format_clean or (lambda x: x)
     format_match = format_match or (lambda x: x)
     format = lambda x: x and format_clean(x)
 
-    if not query:
-        return format(s)
-
-    ls = s.lower()
+    parts = []
+    cur = 0
+    for start, end in spans:
+        parts.append(format(s[cur:start]))
+        parts.append(format_match(s[start:end]))
+        cur = end
+    parts.append(format(s[cur:]))
+    # we use s[0:0], which is "" or u""
+    return s[0:0].join(parts)
 
-    # find overall range of match
-    first, last = _findBestMatch(ls, query)
+def findMatchSpans(s, query):
+    """
+    Return a tuple of the (start, end) spans of @s that match @query,
+    the matching substrings that formatCommonSubstrings() highlights
 
-    if first == -1:
-        return format(s)
+    Results are remembered for the most recent strings and queries.
 
-    # find longest perfect match, put in slc
-    for slc in range(len(query), 0, -1):
-        if query[:slc] == ls[first:first+slc]:
+    >>> findMatchSpans('hi there dude', 'hidude')
+    ((0, 2), (9, 13))
+    >>> findMatchSpans('parallelism', 'lsm')
+    ((7, 8), (9, 11))
+    >>> findMatchSpans('parallelism', 'xyz')
+    ()
+    """
+    cache_key = (s, query)
+    spans = _match_spans_cache.get(cache_key)
+    if spans is not None:
+        return spans
+    spans = []
+    ls = s.lower()
+    offset, end = 0, len(ls)
+    while query:
+        # find overall range of match
+        first, last = _findBestMatch(ls[offset:end], query)
+        if first == -1:
             break
-    key, nextkey = query[:slc], query[slc:]
+        first, last = first + offset, last + offset
+
+        # find longest perfect match, put in slc
+        for slc in range(len(query), 0, -1):
+            if query[:slc] == ls[first:first+slc]:
+                break
+        spans.append((first, first + slc))
+        query = query[slc:]
+        offset, end = first + slc, last
+    spans = tuple(spans)
+    if len(_match_spans_cache) >= MATCH_SPANS_CACHE_SIZE:
+        _match_spans_cache.clear()
+    _match_spans_cache[cache_key] = spans
+    return spans
+
+class PreparedString (object):
+    """
+    A string with the data that score() needs precomputed, so that it
+    can be scored against many queries without doing that work again.
+
+    >>> p = PreparedString('GNOME Terminal')
+    >>> p.lower
+    'gnome terminal'
+    >>> p.wordstarts
+    (6,)
+    >>> p.signature == signature('gnome terminal')
+    True
+    """
+    # Many of these are kept alive at once in a search index
+    __slots__ = ("string", "lower", "wordstarts", "signature")
+    def __init__(self, s):
+        self.string = s
+        self.lower = s.lower()
+        self.wordstarts = _findWordStarts(self.lower)
+        self.signature = signature(self.lower)
+
+    def __repr__(self):
+        return "<PreparedString %r>" % (self.string, )
+
+def _charBit(c):
+    """Return the signature bit for character @c
+
+    Letters and digits get a bit each, other characters share
+    the remaining bits.
+    """
+    o = ord(c)
+    if 97 <= o <= 122:
+        return 1 << (o - 97)
+    if 48 <= o <= 57:
+        return 1 << (o - 22)
+    return 1 << (36 + o % 26)
+
+def signature(s):
+    """
+    Return the character set signature of @s, a bitmask with
+    one bit set for each distinct character in @s
+
+    If a string can match a query, all the bits of the query's
+    signature are set in its signature.  This is a cheap way to
+    rule out most strings before looking for a match.
+
+    >>> signature('trml') & ~signature('terminal')
+    0
+    >>> signature('try') & ~signature('terminal') != 0
+    True
+    >>> signature('')
+    0
+    """
+    sig = 0
+    for c in set(s):
+        sig |= _charBit(c)
+    return sig
 
-    head = s[:first]
-    match = s[first: first+slc]
-    matchtail = s[first+slc: last]
-    tail = s[last:]
+def _findWordStarts(ls):
+    """
+    Return a tuple of the indices in @ls that follow a word separator
 
-    # we use s[0:0], which is "" or u""
-    return s[0:0].join((
-            format(head),
-            format_match(match),
-            formatCommonSubstrings(matchtail, nextkey,
-                                   format_clean, format_match),
-            format(tail),
-            ))
+    >>> _findWordStarts('a-b c  d')
+    (2, 4, 6, 7)
+    """
+    return tuple(i + 1 for i in range(len(ls) - 1) if ls[i] in " -")
 
 def score(s, query):
     """
@@ -111,8 +219,22 @@ def score(s, query):
     """
     if not query:
         return 1.0
+    return score_prepared(PreparedString(s), query)
 
-    ls = s.lower()
+def score_prepared(prepared, query):
+    """
+    Like score(), but for a PreparedString @prepared
+
+    >>> print(score_prepared(PreparedString('GNOME Terminal'), 'gt'))
+    0.705447409733
+    >>> score_prepared(PreparedString('GNOME Terminal'), 'gt') == \\
+    ...         score('GNOME Terminal', 'gt')
+    True
+    """
+    if not query:
+        return 1.0
+
+    ls = prepared.lower
 
     # Find the shortest possible substring that matches the query
     # and get the ration of their lengths for a base score
@@ -123,18 +245,20 @@ def score(s, query):
     score = len(query) / (last - first)
 
     # Now we weight by string length so shorter strings are better
-    score *= .7 + len(query) / len(s) * .3
+    score *= .7 + len(query) / len(prepared.string) * .3
 
     # Bonus points if the characters start words
     good = 0
     bad = 1
     firstCount = 0
-    for i in range(first, last-1):
-        if ls[i] in " -":
-            if ls[i + 1] in query:
-                firstCount += 1
-            else:
-                bad += 1
+    wordstarts = prepared.wordstarts
+    lo = bisect_right(wordstarts, first)
+    hi = bisect_left(wordstarts, last, lo)
+    for i in wordstarts[lo:hi]:
+        if ls[i] in query:
+            firstCount += 1
+        else:
+            bad += 1
     
     # A first character match counts extra
     if query[0] == ls[0]:
@@ -164,6 +288,103 @@ def score(s, query):
     
     return score
 
+class StringBatch (object):
+    """
+    Many strings prepared to be scored together
+
+    The lowered strings are joined into one buffer, so that the strings
+    matching a query can be found by one regular expression scan in C
+    code, instead of trying each string in turn.
+
+    >>> batch = StringBatch(['Terminal', 'Text Editor', 'Firefox'])
+    >>> batch.matches('te')
+    [0, 1]
+    >>> batch.matches('fx')
+    [2]
+    """
+    separator = "\0"
+
+    def __init__(self, strings):
+        """@strings may be strings or PreparedStrings"""
+        self.prepared = [s if isinstance(s, PreparedString)
+                         else PreparedString(s) for s in strings]
+        lowered = [p.lower for p in self.prepared]
+        # Start offset of each string in the joined buffer
+        self.offsets = array('l')
+        offset = 0
+        for ls in lowered:
+            self.offsets.append(offset)
+            offset += len(ls) + 1
+        self.buffer = self.separator[:0].join(
+                [ls + self.separator for ls in lowered])
+        if self.buffer.count(self.separator) != len(lowered):
+            # strings containing the separator can only be scored one by one
+            self.buffer = None
+
+    def __len__(self):
+        return len(self.prepared)
+
+    def _pattern(self, query):
+        """Return a regular expression matching strings in the buffer
+        that contain all characters of @query in order
+        """
+        # [^c\0]*c finds the first c after the previous character,
+        # which never needs to backtrack to find a longer match
+        parts = [re.escape(query[0])]
+        for c in query[1:]:
+            parts.append("[^%s%s]*%s" % (re.escape(c), self.separator,
+                                         re.escape(c)))
+        return re.compile("".join(parts))
+
+    def matches(self, query):
+        """Return a sorted list of the indices of the strings
+        that have a nonzero score for @query
+        """
+        if not query:
+            return list(range(len(self)))
+        if self.buffer is None or self.separator in query:
+            return [i for i, p in enumerate(self.prepared)
+                    if _findBestMatch(p.lower, query)[0] != -1]
+        indices = []
+        offsets = self.offsets
+        for match in self._pattern(query).finditer(self.buffer):
+            idx = bisect_right(offsets, match.start()) - 1
+            if not indices or indices[-1] != idx:
+                indices.append(idx)
+        return indices
+
+    def scores(self, query):
+        """Return an array of the score for @query of each string"""
+        if not query:
+            return array('d', [1.0]) * len(self)
+        result = array('d', [0.0]) * len(self)
+        prepared = self.prepared
+        for idx in self.matches(query):
+            result[idx] = score_prepared(prepared[idx], query)
+        return result
+
+def score_many(strings, query):
+    """
+    Return an array of the score() of each of @strings for @query
+
+    >>> list(score_many(['terminal', 'Terminal', 'tree'], 'trml'))
+    [0.7350986842105263, 0.7350986842105263, 0.0]
+
+    The result is the same as calling score() for each string
+
+    >>> import random
+    >>> rand = random.Random(0)
+    >>> def rstring(chars, length):
+    ...     return "".join(rand.choice(chars) for i in range(length))
+    >>> for i in range(200):
+    ...     strings = [rstring("abcAB -.", rand.randint(1, 12))
+    ...                for j in range(20)]
+    ...     query = rstring("abc -.", rand.randint(1, 3))
+    ...     expected = [score(s, query) for s in strings]
+    ...     assert list(score_many(strings, query)) == expected, query
+    """
+    return StringBatch(strings).scores(query)
+
 def _findBestMatch(s, query):
     """
     Finds the shortest substring of @s that contains all characters of query
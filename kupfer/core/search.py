@@ -1,6 +1,12 @@
 # -*- coding: UTF-8 -*-
 
+import array
+import itertools
+import weakref
+
+from kupfer import datatools
 from kupfer.core import learn, relevance
+from kupfer.kupferstring import tofolded
 
 def make_rankables(itr, rank=0):
 	return (Rankable(unicode(obj), obj, rank) for obj in itr)
@@ -17,12 +23,12 @@ class Rankable (object):
 	rank doesn't matter, Rankables can still be equal
 	"""
 	# To save memory with (really) many Rankables
-	__slots__ = ("rank", "value", "object", "aliases")
-	def __init__(self, value, obj, rank=0):
+	__slots__ = ("rank", "value", "object", "entry")
+	def __init__(self, value, obj, rank=0, entry=None):
 		self.rank = rank
 		self.value = value
 		self.object = obj
-		self.aliases = getattr(obj, "name_aliases", ())
+		self.entry = entry
 	
 	def __hash__(self):
 		return hash(self.object)
@@ -36,14 +42,201 @@ class Rankable (object):
 	def __repr__(self):
 		return "<Rankable %s repres %s at %x>" % (str(self), repr(self.object), id(self))
 
+class IndexEntry (object):
+	"""
+	Search data for one object: its name and its aliases,
+	prepared for relevance scoring
+
+	The folded name (without diacritics) is an alias, so that it is
+	only computed for objects that are searched.
+	"""
+	__slots__ = ("object", "name", "aliases")
+	def __init__(self, obj, names=None):
+		"""@names: the prepared names of @obj, if already known"""
+		self.object = obj
+		if names is None:
+			names = prepare_names(unicode(obj),
+			                      getattr(obj, "name_aliases", ()))
+		self.name, self.aliases = names
+
+def prepare_names(name, aliases):
+	"""Return the PreparedStrings of @name and of its @aliases"""
+	folded_name = tofolded(name)
+	if folded_name != name and folded_name not in aliases:
+		aliases = (folded_name, ) + tuple(aliases)
+	return (relevance.PreparedString(name),
+	        tuple(relevance.PreparedString(alias) for alias in aliases))
+
+# object -> (name, aliases, prepared names), for objects that are not
+# leaves, like actions; the names do not refer back to the object
+_object_names = weakref.WeakKeyDictionary()
+
+def get_index_entry(obj):
+	"""Return the IndexEntry of @obj
+
+	The search data is kept, so that objects that are not indexed,
+	like actions and leaves of dynamic sources, are not prepared
+	again for every key; it is made again when the name or the
+	aliases change. Leaves keep their entry in a slot that is not
+	pickled, other objects in a weak table.
+	"""
+	name = unicode(obj)
+	aliases = getattr(obj, "name_aliases", ())
+	try:
+		cached = obj._index_entry
+	except AttributeError:
+		return _get_object_entry(obj, name, aliases)
+	if cached is not None and cached[0] == name and cached[1] is aliases:
+		return cached[2]
+	entry = IndexEntry(obj)
+	obj._index_entry = (name, aliases, entry)
+	return entry
+
+def _get_object_entry(obj, name, aliases):
+	try:
+		cached = _object_names.get(obj)
+	except TypeError:
+		# not weakly referable
+		return IndexEntry(obj)
+	if cached is None or cached[0] != name or cached[1] is not aliases:
+		cached = _object_names[obj] = (name, aliases,
+		                               prepare_names(name, aliases))
+	return IndexEntry(obj, cached[2])
+
+class SearchIndex (object):
+	"""
+	Search data for a sequence of @leaves, computed once
+
+	The index is valid as long as the Source returns the very
+	same @leaves object, which ends when it is marked for update
+	or rescanned.
+	"""
+	def __init__(self, leaves):
+		self.leaves = leaves
+		self.entries = [get_index_entry(obj) for obj in leaves]
+		self._batch = None
+		self._batch_owners = None
+
+	def _get_batch(self):
+		"""Return a StringBatch of all names and aliases in the index,
+		and an array mapping each string to its entry's index
+		"""
+		if self._batch is None:
+			strings = []
+			owners = array.array('l')
+			for idx, E in enumerate(self.entries):
+				strings.append(E.name)
+				strings.extend(E.aliases)
+				owners.extend([idx] * (1 + len(E.aliases)))
+			self._batch = relevance.StringBatch(strings)
+			self._batch_owners = owners
+		return self._batch, self._batch_owners
+
+	def matching_entries(self, key):
+		"""Return the entries whose name or an alias matches @key"""
+		batch, owners = self._get_batch()
+		entries = self.entries
+		return [entries[idx] for idx in
+		        datatools.UniqueIterator(owners[i] for i in batch.matches(key))]
+
+	def rankables(self, item_check=None, key=None):
+		"""Return Rankables for the indexed leaves that pass
+		the filter @item_check, and if @key is given, only those
+		that may match @key
+		"""
+		entries = self.matching_entries(key.lower()) if key else self.entries
+		return entry_rankables(entries, item_check)
+
+def entry_rankables(entries, item_check=None):
+	"""Return fresh Rankables for the IndexEntries @entries
+	that pass the filter @item_check"""
+	if not item_check:
+		return (Rankable(E.name.string, E.object, entry=E) for E in entries)
+	return _checked_rankables(entries, item_check)
+
+def _checked_rankables(entries, item_check):
+	# @item_check is a filter, so its output is in the order of @entries
+	ientries = iter(entries)
+	for obj in item_check(E.object for E in entries):
+		for E in ientries:
+			if E.object is obj:
+				yield Rankable(E.name.string, obj, entry=E)
+				break
+
+def record_entries(rankables, store, src):
+	"""Return an iterator of @rankables, from Source @src; when it is
+	exhausted, their IndexEntries are saved in the dict @store
+
+	The entries are saved along with the leaves of @src they came from,
+	see get_recorded_entries.
+	"""
+	leaves = src.cached_items
+	def record():
+		entries = []
+		for rb in rankables:
+			entries.append(rb.entry)
+			yield rb
+		store[src] = (leaves, entries)
+	return record()
+
+def get_recorded_entries(store, src):
+	"""Return the IndexEntries saved by record_entries for Source @src
+	in @store, or None if there are none or its leaves changed since"""
+	try:
+		leaves, entries = store[src]
+	except KeyError:
+		return None
+	if leaves is None or leaves is not src.cached_items:
+		return None
+	return entries
+
+_source_indices = weakref.WeakKeyDictionary()
+
+def get_source_index(src):
+	"""Return the SearchIndex for the leaves of Source @src
+
+	Return None if the leaves of @src can't be indexed
+	"""
+	if src.is_dynamic():
+		return None
+	leaves = src.get_leaves()
+	index = _source_indices.get(src)
+	if index is None or index.leaves is not leaves:
+		index = _source_indices[src] = SearchIndex(leaves)
+	return index
+
+def get_leaf_sources(src):
+	"""Return the Sources whose leaves are the leaves of Source @src,
+	which is only @src itself if it aggregates no other sources"""
+	subsources = src.get_leaf_sources()
+	if subsources is None:
+		return [src]
+	return [S for sub in subsources for S in get_leaf_sources(sub)]
+
+def source_rankables(src, item_check=None, key=None):
+	"""Return Rankables for all leaves of Source @src that pass @item_check
+
+	Indexed search data is used where possible, and then
+	only leaves that may match @key are returned.
+	"""
+	subsources = src.get_leaf_sources()
+	if subsources is not None:
+		return itertools.chain(*[source_rankables(S, item_check, key)
+		                         for S in subsources])
+	index = get_source_index(src)
+	if index is None:
+		items = src.get_leaves()
+		return make_rankables(item_check(items) if item_check else items)
+	return index.rankables(item_check, key)
+
 def bonus_objects(rankables, key):
 	"""generator of @rankables that have mnemonics for @key
 
 	rank is added to prev rank, all items are yielded"""
 	key = key.lower()
-	get_record_score = learn.get_record_score
+	get_record_score = learn.get_record_scorer(key)
 	for obj in rankables:
-		obj.rank += get_record_score(obj.object, key)
+		obj.rank += get_record_score(repr(obj.object))
 		obj.rank += obj.object.rank_adjust
 		yield obj
 
@@ -57,19 +250,25 @@ def score_objects(rankables, key):
 
 	rank is added to previous rank,
 	if not @key, then all items are returned"""
-	_score = relevance.score
+	_score = relevance.score_prepared
 	key = key.lower()
+	# an object can only match if it has all the characters of the key
+	keybits = relevance.signature(key)
 	for rb in rankables:
+		entry = rb.entry = rb.entry or get_index_entry(rb.object)
 		# Rank object
-		rank = _score(rb.value, key)*100
+		name = entry.name
+		rank = 0 if keybits & ~name.signature else _score(name, key)*100
 		if rank < 90:
-			for alias in rb.aliases:
+			for alias in entry.aliases:
+				if keybits & ~alias.signature:
+					continue
 				# consider aliases and change rb.value if alias is better
 				# aliases rank lower so that value is chosen when close
 				arank = _score(alias, key)*95
 				if arank > rank:
 					rank = arank
-					rb.value = alias
+					rb.value = alias.string
 		if rank:
 			rb.rank = rank
 			yield rb
@@ -79,15 +278,18 @@ def score_actions(rankables, for_leaf):
 	"""Alternative (rigid) scoring mechanism for objects,
 	putting much more weight in rank_adjust
 	"""
-	get_record_score = learn.get_record_score
+	get_name_score = learn.get_name_score
+	correlated = learn.get_correlated_name(for_leaf)
 	for obj in rankables:
+		name = repr(obj.object)
 		ra = obj.object.rank_adjust
-		ra += learn.get_correlation_bonus(obj.object, for_leaf)
+		if name == correlated:
+			ra += 50
 		if ra > 0:
-			obj.rank = 50 + ra + get_record_score(obj.object)//2
+			obj.rank = 50 + ra + get_name_score(name)//2
 		elif ra == 0:
-			obj.rank = get_record_score(obj.object)
+			obj.rank = get_name_score(name)
 		else:
-			obj.rank = -50 + ra + get_record_score(obj.object)
+			obj.rank = -50 + ra + get_name_score(name)
 		yield obj
 
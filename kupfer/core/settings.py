@@ -40,6 +40,14 @@ class SettingsController (gobject.GObject, pretty.OutputMixin):
 		"DeepDirectories" : { "direct" : (), "catalog" : (), "depth" : 1, },
 		'Keybindings': {},
 		"Tools": {},
+		"Learning": { "frecency" : False, "registersize" : 500, },
+		"Icons": { "cachesize" : 4096, },
+		"Cache": {
+			"catalogfile" : False,
+			"codec" : "auto",
+			"compresslevel" : 3,
+			"rawlimit" : 16,
+		},
 	}
 	def __init__(self):
 		gobject.GObject.__init__(self)
@@ -1,63 +1,261 @@
 from __future__ import with_statement
 
-import gzip
 import hashlib
 import itertools
 import cPickle as pickle
 import os
+from pickle import Pickler
 import threading
 import time
 import weakref
+import Queue
+from cStringIO import StringIO
+
+import gobject
 
 from kupfer import config, pretty, scheduler
 from kupfer import conspickle
 from kupfer.obj import base, sources
-from kupfer.core import pluginload
+from kupfer.core import cachecodec, catalogcache, learn, pluginload
 
 class InternalError (Exception):
 	pass
 
+# number of threads rescanning sources
+RESCAN_WORKERS = 2
+# largest fraction of the time that rescanning may take
+RESCAN_BUDGET = 0.2
+# sources taking longer than this (in seconds) to rescan are
+# rescanned less often
+EXPENSIVE_RESCAN = 1.0
+# sources with leaves used at least this often (time-decayed hits,
+# see learn) are rescanned first
+FREQUENT_FRECENCY = 0.5
+# bounds of the rescan interval learned for each source (seconds)
+MIN_RESCAN_INTERVAL = 120
+MAX_RESCAN_INTERVAL = 6 * 3600
+# the interval grows by this factor when a rescan finds no changes,
+# and shrinks by it when it finds changes
+RESCAN_BACKOFF = 1.5
+
+# number of threads loading source caches at startup
+RESTORE_WORKERS = 4
+
+def _map_threaded(function, items, workers):
+	"""Yield function(item) for each of @items, computed by @workers
+	threads, in the order they are finished"""
+	jobs = Queue.Queue()
+	results = Queue.Queue()
+
+	def worker():
+		while True:
+			item = jobs.get()
+			if item is None:
+				return
+			try:
+				results.put(function(item))
+			except Exception:
+				pretty.print_exc(__name__)
+				results.put(None)
+
+	items = list(items)
+	for item in items:
+		jobs.put(item)
+	threads = []
+	for i in xrange(min(workers, len(items))):
+		jobs.put(None)
+		thread = threading.Thread(target=worker)
+		thread.setDaemon(True)
+		thread.start()
+		threads.append(thread)
+	for item in items:
+		yield results.get()
+	for thread in threads:
+		thread.join()
+
+def _get_leaves_digest(leaves):
+	"""Return a hash of the reprs and names of @leaves, in any order"""
+	return hash(frozenset((repr(leaf), unicode(leaf)) for leaf in leaves))
+
+class RescanRecord (object):
+	"""What PeriodicRescanner has learned about rescanning one source"""
+	def __init__(self, interval):
+		self.interval = interval
+		self.cost = 0.0
+		self.digest = None
+		self.rescans = 0
+		self.changes = 0
+
+	def update(self, leaves, cost):
+		"""Update the record after a rescan finding @leaves
+		that took @cost seconds
+
+		The interval is shortened if the leaves changed since the
+		previous rescan and lengthened otherwise.
+		"""
+		self.cost = (self.cost + cost) / 2 if self.rescans else cost
+		digest = _get_leaves_digest(leaves)
+		if self.digest is not None:
+			if digest != self.digest:
+				self.changes += 1
+				self.interval = max(MIN_RESCAN_INTERVAL,
+				                    self.interval / RESCAN_BACKOFF)
+			else:
+				self.interval = min(MAX_RESCAN_INTERVAL,
+				                    self.interval * RESCAN_BACKOFF)
+		self.digest = digest
+		self.rescans += 1
+
 class PeriodicRescanner (pretty.OutputMixin):
 	"""
 	Periodically rescan a @catalog of sources
 
 	Do first rescan after @startup seconds, then
-	followup with rescans in @period.
-
-	Each campaign of rescans is separarated by @campaign
-	seconds
+	followup with rescans at least @period apart on each thread.
+
+	Each source is rescanned when its rescan interval has passed. The
+	interval starts at a quarter of @campaign and is learned from how
+	often rescans find changed leaves. The catalog is checked for
+	sources to rescan at least every @campaign seconds.
+
+	Rescans run on @workers threads, toplevel sources and sources
+	with frequently used leaves first. After each rescan, a thread
+	pauses so that rescanning takes at most the fraction @budget of
+	the time, and sources that are expensive to rescan are rescanned
+	less often.
 	"""
-	def __init__(self, period=5, startup=10, campaign=3600):
+	def __init__(self, period=5, startup=10, campaign=3600,
+	             workers=RESCAN_WORKERS, budget=RESCAN_BUDGET):
 		self.startup = startup
 		self.period = period
 		self.campaign=campaign
+		self.budget = budget
 		self.timer = scheduler.Timer()
+		self.catalog = ()
+		self.toplevel = ()
 		# Source -> time mapping
 		self.latest_rescan_time = weakref.WeakKeyDictionary()
+		# Source -> RescanRecord
+		self.records = weakref.WeakKeyDictionary()
 		self._min_rescan_interval = campaign//4
-
-	def set_catalog(self, catalog):
+		self._queue = Queue.PriorityQueue()
+		# the sources in the queue, as keys
+		self._queued = weakref.WeakKeyDictionary()
+		self._queued_lock = threading.Lock()
+		self._counter = itertools.count()
+		self._workers = workers
+		self._threads = []
+		self._stopped = threading.Event()
+
+	def set_catalog(self, catalog, toplevel=()):
 		self.catalog = catalog
-		self.cur = iter(self.catalog)
+		self.toplevel = toplevel
 		self.output_debug("Registering new campaign, in %d s" % self.startup)
 		self.timer.set(self.startup, self._new_campaign)
-	
+
 	def _new_campaign(self):
-		self.output_info("Starting new campaign, interval %d s" % self.period)
-		self.cur = iter(self.catalog)
-		self.timer.set(self.period, self._periodic_rescan_helper)
-
-	def _periodic_rescan_helper(self):
-		# Advance until we find a source that was not recently rescanned
-		for next in self.cur:
-			oldtime = self.latest_rescan_time.get(next, 0)
-			if (time.time() - oldtime) > self._min_rescan_interval:
-				self.timer.set(self.period, self._periodic_rescan_helper)
-				self._start_source_rescan(next)
+		frequent = None
+		now = time.time()
+		due = []
+		next_check = now + self.campaign
+		with self._queued_lock:
+			queued = set(self._queued.keys())
+		for source in list(self.catalog):
+			if source.is_dynamic() or source in queued:
+				continue
+			rescan_time = self._get_next_rescan_time(source)
+			if rescan_time <= now:
+				if frequent is None:
+					frequent = learn.get_frequent_names(FREQUENT_FRECENCY)
+				due.append((self._get_priority(source, frequent), source))
+			else:
+				next_check = min(next_check, rescan_time)
+		for priority, source in due:
+			with self._queued_lock:
+				self._queued[source] = True
+			self._queue.put((priority, self._counter.next(),
+			                 weakref.ref(source)))
+		if due and not self._threads and not self._stopped.isSet():
+			self._start_workers()
+		delay = max(next_check - now, MIN_RESCAN_INTERVAL)
+		self.output_debug("Queued %d sources, next check in %d s" %
+		                  (len(due), delay))
+		self.timer.set(delay, self._new_campaign)
+
+	def _get_record(self, source):
+		try:
+			return self.records[source]
+		except KeyError:
+			record = self.records[source] = \
+				RescanRecord(self._min_rescan_interval)
+			return record
+
+	def _get_rescan_interval(self, source):
+		"""Return the learned interval, longer for expensive sources"""
+		record = self._get_record(source)
+		return record.interval * max(1, record.cost / EXPENSIVE_RESCAN)
+
+	def _get_next_rescan_time(self, source):
+		oldtime = self.latest_rescan_time.get(source, 0)
+		return oldtime + self._get_rescan_interval(source)
+
+	def _get_priority(self, source, frequent_names):
+		"""Return the sort key of @source in the rescan queue"""
+		hits = 0
+		leaves = source.cached_items
+		if frequent_names and isinstance(leaves, list):
+			hits = sum(1 for leaf in leaves if repr(leaf) in frequent_names)
+		toplevel = source in self.toplevel
+		return (not toplevel, -hits, self._get_record(source).cost)
+
+	def get_schedule(self):
+		"""Return a list of (source, next rescan time, RescanRecord)
+		of the sources that are rescanned periodically, soonest first
+		"""
+		schedule = [(source, self._get_next_rescan_time(source),
+		             self._get_record(source))
+		            for source in list(self.catalog)
+		            if not source.is_dynamic()]
+		schedule.sort(key=lambda item: item[1])
+		return schedule
+
+	def _start_workers(self):
+		for i in xrange(self._workers):
+			thread = threading.Thread(target=self._worker)
+			thread.setDaemon(True)
+			thread.start()
+			self._threads.append(thread)
+
+	def _worker(self):
+		while not self._stopped.isSet():
+			ref = self._queue.get()[-1]
+			if ref is None:
+				# stopped by finalize()
 				return
-		# No source to scan found
-		self.output_info("Campaign finished, pausing %d s" % self.campaign)
-		self.timer.set(self.campaign, self._new_campaign)
+			source = ref()
+			if source is None:
+				continue
+			with self._queued_lock:
+				self._queued.pop(source, None)
+			if source not in self.catalog:
+				continue
+			try:
+				cost = self._start_source_rescan(source)
+			except Exception:
+				self.output_exc()
+				continue
+			# pause so that all threads together stay within the budget
+			self._stopped.wait(max(self.period,
+			                       cost * (self._workers / self.budget - 1)))
+
+	def finalize(self):
+		"""Stop rescanning; the threads exit after their current rescan"""
+		self.timer.invalidate()
+		self._stopped.set()
+		for thread in self._threads:
+			# () sorts before all priorities
+			self._queue.put(((), self._counter.next(), None))
+		self._threads = []
 
 	def rescan_now(self, source, force_update=False):
 		"Rescan @source immediately"
@@ -67,24 +265,28 @@ class PeriodicRescanner (pretty.OutputMixin):
 		self.rescan_source(source, force_update=force_update)
 
 	def _start_source_rescan(self, source):
-		self.latest_rescan_time[source] = time.time()
-		if not source.is_dynamic():
-			thread = threading.Thread(target=self.rescan_source, args=(source,))
-			thread.setDaemon(True)
-			thread.start()
+		"""Rescan @source and return the time it took"""
+		start = self.latest_rescan_time[source] = time.time()
+		leaves = self.rescan_source(source)
+		cost = time.time() - start
+		self._get_record(source).update(leaves, cost)
+		return cost
 
 	def rescan_source(self, source, force_update=True):
-		list(source.get_leaves(force_update=force_update))
+		return list(source.get_leaves(force_update=force_update))
 
 class SourcePickler (pretty.OutputMixin):
 	"""
 	Takes care of pickling and unpickling Kupfer Sources.
 	"""
-	pickle_version = 4
-	name_template = "k%s-v%d.pickle.gz"
+	pickle_version = 5
+	name_template = "k%s-v%d.pickle"
+	# name templates of cache files of the previous version
+	old_name_templates = ("k%s-v%d.pickle.gz", )
 
-	def __init__(self):
-		self.open = lambda f,mode: gzip.open(f, mode, compresslevel=3)
+	def __init__(self, codecs=None):
+		self.open = open
+		self.codecs = codecs or cachecodec.CodecPolicy()
 
 	def should_use_cache(self):
 		return config.has_capability("CACHE")
@@ -96,13 +298,14 @@ class SourcePickler (pretty.OutputMixin):
 		for dpath, dirs, files in os.walk(config.get_cache_home()):
 			# Look for files matching beginning and end of
 			# name_template, with the previous file version
-			chead, ctail = self.name_template.split("%s")
-			ctail = ctail % ((self.pickle_version -1),)
 			obsolete_files = []
-			for cfile in files:
-				if cfile.startswith(chead) and cfile.endswith(ctail):
-					cfullpath = os.path.join(dpath, cfile)
-					obsolete_files.append(cfullpath)
+			for template in (self.name_template, ) + self.old_name_templates:
+				chead, ctail = template.split("%s")
+				ctail = ctail % ((self.pickle_version -1),)
+				for cfile in files:
+					if cfile.startswith(chead) and cfile.endswith(ctail):
+						cfullpath = os.path.join(dpath, cfile)
+						obsolete_files.append(cfullpath)
 		if obsolete_files:
 			self.output_info("Removing obsolete cache files:", sep="\n",
 					*obsolete_files)
@@ -112,44 +315,72 @@ class SourcePickler (pretty.OutputMixin):
 				assert "kupfer" in fpath
 				os.unlink(fpath)
 
-	def get_filename(self, source):
-		"""Return cache filename for @source"""
+	def get_source_key(self, source):
+		"""Return a string identifying the cache of @source"""
 		# make sure we take the source name into account
 		# so that we get a "break" when locale changes
 		source_id = "%s%s%s" % (repr(source), str(source), source.version)
 		bytes = hashlib.md5(source_id).digest()
-		hashstr = bytes.encode("base64").rstrip("\n=").replace("/", "-")
+		return bytes.encode("base64").rstrip("\n=").replace("/", "-")
+
+	def get_filename(self, source):
+		"""Return cache filename for @source"""
+		hashstr = self.get_source_key(source)
 		filename = self.name_template % (hashstr, self.pickle_version)
 		return os.path.join(config.get_cache_home(), filename)
 
+	def get_saved_time(self, source):
+		"""Return the time the cache of @source was saved, if it is
+		known without loading it"""
+		return None
+
+	def finish(self):
+		"""Finish writing caches"""
+		pass
+
 	def unpickle_source(self, source):
-		if not self.should_use_cache():
-			return None
+		return self.loads_source(source, self.read_source(source))
 
-		cached = self._unpickle_source(self.get_filename(source))
-		if not cached:
-			return None
+	def read_source(self, source):
+		"""Return the cache record of @source, or None
 
-		# check consistency
-		if source == cached:
-			return cached
-		else:
-			self.output_debug("Cached version mismatches", source)
-		return None
-	def _unpickle_source(self, pickle_file):
+		Only reads and decompresses, so it may be called in any thread.
+		"""
+		if not self.should_use_cache():
+			return None
+		pickle_file = self.get_filename(source)
 		try:
 			pfile = self.open(pickle_file, "rb")
 		except IOError, e:
 			return None
 		try:
-			source = pickle.loads(pfile.read())
-			assert isinstance(source, base.Source), "Stored object not a Source"
+			return (cachecodec.decode(pfile.read()), pickle_file)
+		except (EnvironmentError, ValueError), e:
+			self.output_info("Error loading %s: %s" % (pickle_file, e))
+			return None
+		finally:
+			pfile.close()
+
+	def loads_source(self, source, record):
+		"""Return the Source unpickled from @record, the cache record of
+		@source, or None"""
+		if record is None:
+			return None
+		data, pickle_file = record
+		try:
+			cached = pickle.loads(data)
+			assert isinstance(cached, base.Source), "Stored object not a Source"
 			sname = os.path.basename
-			self.output_debug("Loading", source, "from", sname(pickle_file))
+			self.output_debug("Loading", cached, "from", sname(pickle_file))
 		except (pickle.PickleError, Exception), e:
-			source = None
 			self.output_info("Error loading %s: %s" % (pickle_file, e))
-		return source
+			return None
+		# check consistency
+		if source == cached:
+			return cached
+		else:
+			self.output_debug("Cached version mismatches", source)
+		return None
 
 	def pickle_source(self, source):
 		if not self.should_use_cache():
@@ -159,16 +390,125 @@ class SourcePickler (pretty.OutputMixin):
 		"""
 		When writing to a file, use pickle.dumps()
 		and then write the file in one go --
-		if the file is a gzip file, pickler's thousands
-		of small writes are very slow
+		the codec of the record is chosen by its size
 		"""
+		data = pickle.dumps(source, pickle.HIGHEST_PROTOCOL)
+		codec = self.codecs.choose(len(data))
 		output = self.open(pickle_file, "wb")
 		sname = os.path.basename
-		self.output_debug("Storing", source, "as", sname(pickle_file))
-		output.write(pickle.dumps(source, pickle.HIGHEST_PROTOCOL))
+		self.output_debug("Storing", source, "as", sname(pickle_file),
+		                  "with", codec.name)
+		output.write(cachecodec.encode(data, codec))
 		output.close()
 		return True
 
+def _loads(record):
+	"""Unpickle @record, compressed with any codec"""
+	return pickle.loads(cachecodec.decode(record))
+
+class _BareSourcePickler (Pickler):
+	"""Pickles @source without its cached items, leaving @source as it is
+
+	Other threads may use the cached items of @source while it is
+	pickled, so they are only left out of the pickled state.
+	"""
+	def __init__(self, output, source):
+		Pickler.__init__(self, output, pickle.HIGHEST_PROTOCOL)
+		self.source = source
+
+	def save_reduce(self, func, args, state=None, listitems=None,
+	                dictitems=None, obj=None):
+		if obj is self.source and isinstance(state, dict):
+			state = dict(state)
+			state["cached_items"] = None
+		Pickler.save_reduce(self, func, args, state, listitems, dictitems, obj)
+
+def _dumps_bare_source(source):
+	"""Return the pickle of @source without its cached items"""
+	output = StringIO()
+	_BareSourcePickler(output, source).dump(source)
+	return output.getvalue()
+
+class CatalogPickler (SourcePickler):
+	"""
+	Pickles Sources into one catalog cache file. The leaves of a
+	restored source are only unpickled when they are first used.
+
+	finish() must be called to write the file.
+	"""
+	catalog_filename = "catalog-v%d.cache"
+
+	def __init__(self, codecs=None):
+		SourcePickler.__init__(self, codecs)
+		filename = self.catalog_filename % self.pickle_version
+		self.cache = catalogcache.CatalogCache(
+				os.path.join(config.get_cache_home(), filename))
+
+	def rm_old_cachefiles(self):
+		SourcePickler.rm_old_cachefiles(self)
+		filename = self.catalog_filename % (self.pickle_version - 1)
+		old_catalog = os.path.join(config.get_cache_home(), filename)
+		if os.path.exists(old_catalog):
+			self.output_info("Removing obsolete cache file:", old_catalog)
+			os.unlink(old_catalog)
+
+	def get_saved_time(self, source):
+		return self.cache.get_saved_time(self.get_source_key(source))
+
+	def read_source(self, source):
+		if not self.should_use_cache():
+			return None
+		key = self.get_source_key(source)
+		entry = self.cache.get(key)
+		if entry is None:
+			return None
+		source_record, leaves_record, saved = entry
+		try:
+			return (cachecodec.decode(source_record), leaves_record, key)
+		except ValueError, e:
+			self.output_info("Error loading %s: %s" % (source, e))
+			return None
+
+	def loads_source(self, source, record):
+		if record is None:
+			return None
+		data, leaves_record, key = record
+		try:
+			cached = pickle.loads(data)
+			assert isinstance(cached, base.Source), "Stored object not a Source"
+		except (pickle.PickleError, Exception), e:
+			self.output_info("Error loading %s: %s" % (source, e))
+			return None
+		if not source == cached:
+			self.output_debug("Cached version mismatches", source)
+			return None
+		if leaves_record:
+			cached.cached_items = catalogcache.LazyLeaves(leaves_record, _loads)
+		self.output_debug("Loading", cached, "from", key)
+		return cached
+
+	def pickle_source(self, source):
+		if not self.should_use_cache():
+			return None
+		items = source.cached_items
+		if isinstance(items, catalogcache.LazyLeaves) and items.record:
+			# not used this session, save without unpickling
+			leaves_record = items.record
+		elif items is not None:
+			leaves_record = self.codecs.encode(
+					pickle.dumps(list(items), pickle.HIGHEST_PROTOCOL))
+		else:
+			leaves_record = ""
+		# the leaves are stored separately
+		source_record = self.codecs.encode(_dumps_bare_source(source))
+		key = self.get_source_key(source)
+		self.output_debug("Storing", source, "as", key)
+		self.cache.put(key, source_record, leaves_record)
+		return True
+
+	def finish(self):
+		self.cache.save()
+
 class SourceDataPickler (pretty.OutputMixin):
 	""" Takes care of pickling and unpickling Kupfer Sources' configuration
 	or data.
@@ -187,8 +527,9 @@ class SourceDataPickler (pretty.OutputMixin):
 	pickle_version = 1
 	name_template = "config-%s-v%d.pickle"
 
-	def __init__(self):
+	def __init__(self, codecs=None):
 		self.open = open
+		self.codecs = codecs or cachecodec.CodecPolicy()
 
 	@classmethod
 	def get_filename(cls, source):
@@ -213,7 +554,8 @@ class SourceDataPickler (pretty.OutputMixin):
 		except IOError, e:
 			return None
 		try:
-			data = conspickle.BasicUnpickler.loads(pfile.read())
+			data = conspickle.BasicUnpickler.loads(
+					cachecodec.decode(pfile.read()))
 			sname = os.path.basename(pickle_file)
 			self.output_debug("Loaded configuration from", sname)
 			# self.output_debug(data)
@@ -241,7 +583,7 @@ class SourceDataPickler (pretty.OutputMixin):
 			## Write to temporary and rename into place
 			tmp_pickle_file = "%s.%s" % (pickle_file, os.getpid())
 			output = self.open(tmp_pickle_file, "wb")
-			output.write(data)
+			output.write(self.codecs.encode(data))
 			output.close()
 			os.rename(tmp_pickle_file, pickle_file)
 		return True
@@ -264,24 +606,45 @@ class SourceController (pretty.OutputMixin):
 		self.loaded_successfully = False
 		self.did_finalize_sources = False
 		self._pre_root = None
+		# (plugin_id, sources, toplevel) to add in initialize()
+		self._pending = []
+		# Source -> plugin_id of sources restored in the background
+		self._restoring = {}
+		self._catalog_pickler = None
+		self._restore_start = 0
 
 	def add(self, plugin_id, srcs, toplevel=False, initialize=False):
+		"""Add @srcs, restored from cache if possible
+
+		Unless @initialize, the sources are added when initialize()
+		is called.
+		"""
+		if not initialize and not self.loaded_successfully:
+			self._pending.append((plugin_id, srcs, toplevel))
+			return
+		sources = self._add(plugin_id, srcs, toplevel, self._try_restore(srcs))
+		if initialize:
+			self._initialize_sources(sources)
+			self._cache_sources(sources)
+			self.rescanner.set_catalog(self.sources, self.toplevel_sources)
+
+	def _add(self, plugin_id, srcs, toplevel, restored):
+		"""Add the restored instances of @srcs, which are in @restored
+		if they could be restored, and return the added instances"""
 		self._invalidate_root()
-		sources = set(self._try_restore(srcs))
+		sources = set(restored)
 		sources.update(srcs)
 
 		self.sources.update(sources)
 		if toplevel:
 			self.toplevel_sources.update(sources)
-		if initialize:
-			self._initialize_sources(sources)
-			self._cache_sources(sources)
-			self.rescanner.set_catalog(self.sources)
 		if plugin_id:
 			self._register_plugin_objects(plugin_id, *sources)
+		return sources
 
 	def set_toplevel(self, src, toplevel):
-		assert src in self.sources, "Source is not tracked in SourceController"
+		assert src in self, "Source is not tracked in SourceController"
+		src = self[src]
 		self._invalidate_root()
 		if toplevel:
 			self.toplevel_sources.add(src)
@@ -298,12 +661,14 @@ class SourceController (pretty.OutputMixin):
 		self._invalidate_root()
 		self.toplevel_sources.discard(src)
 		self.sources.discard(src)
-		self.rescanner.set_catalog(self.sources)
+		self.rescanner.set_catalog(self.sources, self.toplevel_sources)
 		self._finalize_source(src)
 		pretty.print_debug(__name__, "Remove", repr(src))
 
 	def get_plugin_id_for_object(self, obj):
 		id_ = self.plugin_object_map.get(obj)
+		if id_ is None:
+			id_ = self._restoring.get(obj)
 		#self.output_debug("Object", repr(obj), "has id", id_, id(obj))
 		return id_
 
@@ -315,6 +680,12 @@ class SourceController (pretty.OutputMixin):
 		removed_source = False
 		self.output_debug("Removing objects for plugin:", plugin_id)
 
+		# sources not added yet or still being restored
+		self._pending = [p for p in self._pending if p[0] != plugin_id]
+		for src, src_plugin_id in self._restoring.items():
+			if src_plugin_id == plugin_id:
+				del self._restoring[src]
+
 		# sources
 		for src in list(self.sources):
 			if self.get_plugin_id_for_object(src) == plugin_id:
@@ -341,6 +712,10 @@ class SourceController (pretty.OutputMixin):
 		return removed_source
 
 	def get_sources(self):
+		"""Return all sources, including those still being restored
+		in the background"""
+		if self._restoring:
+			return self.sources.union(self._restoring)
 		return self.sources
 
 	def add_text_sources(self, plugin_id, srcs):
@@ -383,10 +758,12 @@ class SourceController (pretty.OutputMixin):
 			action.name += " (%s)" % (type(action).__module__.split(".")[-1],)
 
 	def __contains__(self, src):
-		return src in self.sources
+		return src in self.sources or src in self._restoring
 	def __getitem__(self, src):
 		if not src in self:
 			raise KeyError
+		if src in self._restoring:
+			return self._restore_now(src)
 		for s in self.sources:
 			if s == src:
 				return s
@@ -494,6 +871,7 @@ class SourceController (pretty.OutputMixin):
 
 	def finalize(self):
 		"Finalize all sources, equivalent to deactivating all sources"
+		self.rescanner.finalize()
 		for src in self.sources:
 			src.finalize()
 		self.did_finalize_sources = True
@@ -530,36 +908,97 @@ class SourceController (pretty.OutputMixin):
 		elif not source.is_dynamic():
 			self._pickle_source(source)
 
+	def _get_source_pickler(self):
+		"""Return the SourcePickler to use, a shared CatalogPickler if
+		the catalog is cached in one file"""
+		from kupfer.core import settings
+		setctl = settings.GetSettingsController()
+		if not setctl.get_config("Cache", "catalogfile"):
+			return SourcePickler(self._get_codec_policy(setctl))
+		if self._catalog_pickler is None:
+			self._catalog_pickler = CatalogPickler(self._get_codec_policy(setctl))
+		return self._catalog_pickler
+
+	def _get_codec_policy(self, setctl):
+		"""Return the CodecPolicy of source caches set in @setctl"""
+		return cachecodec.CodecPolicy(setctl.get_config("Cache", "codec"),
+				setctl.get_config("Cache", "compresslevel"),
+				setctl.get_config("Cache", "rawlimit") * 1024)
+
 	def _pickle_sources(self, sources):
-		sourcepickler = SourcePickler()
+		start = time.time()
+		sourcepickler = self._get_source_pickler()
 		sourcepickler.rm_old_cachefiles()
+		count = 0
 		for source in sources:
 			if (source.is_dynamic() or
 				SourceDataPickler.source_has_config(source)):
 				continue
 			self._pickle_source(source, pickler=sourcepickler)
+			count += 1
+		sourcepickler.finish()
+		self.output_debug("Saved caches of %d sources in %.3f s" %
+		                  (count, time.time() - start))
 
-	@classmethod
 	def _pickle_source(self, source, pickler=None):
-		sourcepickler = pickler or SourcePickler()
+		sourcepickler = pickler or self._get_source_pickler()
 		sourcepickler.pickle_source(source)
+		if not pickler:
+			sourcepickler.finish()
 
-	def _try_restore(self, sources):
+	def _try_restore(self, sources, workers=1):
 		"""
 		Try to restore the source that is equivalent to the
 		"dummy" instance @source, from cache, or from saved configuration.
 		yield the instances that succeed.
+
+		Caches are read by @workers threads, and restored sources
+		are yielded in the order they are read.
 		"""
-		sourcepickler = SourcePickler()
 		configsaver = SourceDataPickler()
+		cached = []
 		for source in set(sources):
 			if configsaver.source_has_config(source):
 				configsaver.load_source(source)
+				yield source
 			else:
-				source = sourcepickler.unpickle_source(source)
+				cached.append(source)
+		for dummy, record in self._read_caches(cached, workers):
+			source = self._load_cache(dummy, record)
 			if source:
 				yield source
 
+	def _read_caches(self, sources, workers=1):
+		"""Return an iterator of (source, record) for the cache records
+		of @sources, read by @workers threads
+
+		Only reads the files, so it may be iterated in any thread.
+		"""
+		sourcepickler = self._get_source_pickler()
+		def read(source):
+			return source, sourcepickler.read_source(source)
+		if workers > 1:
+			records = _map_threaded(read, sources, workers)
+		else:
+			records = itertools.imap(read, sources)
+		return (item for item in records if item and item[1] is not None)
+
+	def _load_cache(self, source, record):
+		"""Return the source unpickled from @record, the cache record of
+		the "dummy" instance @source, or None
+
+		Unpickling runs the plugin code of the source, so this must
+		be called in the main thread.
+		"""
+		sourcepickler = self._get_source_pickler()
+		cached = sourcepickler.loads_source(source, record)
+		if cached:
+			# a recently saved cache is as good as a rescan
+			saved = sourcepickler.get_saved_time(cached)
+			if saved:
+				self.rescanner.latest_rescan_time[cached] = saved
+		return cached
+
 	def _remove_source(self, source):
 		"Oust @source from catalog if any exception is raised"
 		self.sources.discard(source)
@@ -568,12 +1007,105 @@ class SourceController (pretty.OutputMixin):
 		for typ in self.content_decorators:
 			self.content_decorators[typ].discard(source_type)
 
-	def initialize(self):
-		"Initialize all sources and cache toplevel sources"
+	def initialize(self, restored_callback=None):
+		"""Restore and initialize all sources and cache toplevel sources
+
+		The toplevel sources are ready when this returns, the caches of
+		the other sources are loaded in the background. They are added
+		to the catalog as they are ready, and @restored_callback is
+		called when they all are.
+		"""
+		start = time.time()
+		now, later = [], []
+		for plugin_id, srcs, toplevel in self._pending:
+			for src in srcs:
+				# sources with configuration are restored from it, and
+				# only cached sources outside the toplevel can wait
+				if toplevel or SourceDataPickler.source_has_config(src):
+					now.append((plugin_id, (src, ), toplevel))
+				else:
+					later.append((plugin_id, (src, ), toplevel))
+		self._pending = []
+		self._add_pending(now)
 		self._initialize_sources(self.sources)
-		self.rescanner.set_catalog(self.sources)
+		self.rescanner.set_catalog(self.sources, self.toplevel_sources)
 		self._cache_sources(self.toplevel_sources)
 		self.loaded_successfully = True
+		self.output_debug("Restored %d sources in %.3f s" %
+		                  (len(self.sources), time.time() - start))
+		if later:
+			self._restore_in_background(later, restored_callback)
+
+	def _add_pending(self, pending):
+		"""Add the sources of @pending, restoring them in parallel"""
+		srcs = [src for plugin_id, sources, toplevel in pending
+		             for src in sources]
+		restored = dict((src, src) for src in
+		                self._try_restore(srcs, RESTORE_WORKERS))
+		for plugin_id, sources, toplevel in pending:
+			self._add(plugin_id, sources, toplevel,
+			          [restored[src] for src in sources if src in restored])
+
+	def _restore_in_background(self, pending, callback):
+		for plugin_id, sources, toplevel in pending:
+			for src in sources:
+				self._restoring[src] = plugin_id
+		srcs = list(self._restoring)
+		self.output_debug("Restoring %d sources in the background" % len(srcs))
+		self._restore_start = time.time()
+
+		records = self._read_caches(srcs, RESTORE_WORKERS)
+		def restore():
+			for source, record in records:
+				gobject.idle_add(self._add_restored, source, record)
+			gobject.idle_add(self._restoring_finished, callback)
+		thread = threading.Thread(target=restore)
+		thread.setDaemon(True)
+		thread.start()
+
+	def _add_restored(self, dummy, record):
+		"""Add the source restored from @record, read in the background,
+		to the catalog"""
+		if self.did_finalize_sources or dummy not in self._restoring:
+			return
+		source = self._load_cache(dummy, record)
+		if not source:
+			# left to be added as it is when all are restored
+			return
+		plugin_id = self._restoring.pop(dummy)
+		self._add(plugin_id, (source, ), False, ())
+		self._initialize_sources((source, ))
+
+	def _restore_now(self, src):
+		"""Restore the source equal to @src, which is still being restored
+		in the background, and add it at once; return the added instance"""
+		for dummy in self._restoring:
+			if dummy == src:
+				break
+		plugin_id = self._restoring.pop(dummy)
+		sources = self._add(plugin_id, (dummy, ), False,
+		                    self._try_restore((dummy, )))
+		self._initialize_sources(sources)
+		(source, ) = sources
+		return source
+
+	def _restoring_finished(self, callback):
+		if self.did_finalize_sources:
+			return
+		# sources that could not be restored are added as they are
+		for source, plugin_id in self._restoring.items():
+			self._add(plugin_id, (source, ), False, ())
+		self._initialize_sources(self._restoring)
+		self._restoring.clear()
+		# sources with configuration may refer to objects that were
+		# not in the catalog yet
+		for source in self.sources:
+			if SourceDataPickler.source_has_config(source):
+				source.mark_for_update()
+		self.output_debug("Restored all sources in %.3f s" %
+		                  (time.time() - self._restore_start))
+		if callback:
+			callback()
 
 	def _initialize_sources(self, sources):
 		for src in set(sources):
@@ -1,11 +1,6 @@
+import heapq
 import itertools
 
-try:
-	from collections import OrderedDict
-except ImportError:
-	from UserDict import DictMixin
-	OrderedDict = None
-
 class SavedIterable (object):
 	"""Wrap an iterable and cache it.
 
@@ -99,142 +94,142 @@ def UniqueIterator(seq, key=None):
 				yield obj
 				coll.add(K)
 
-
-if not OrderedDict:
+def largest_first(seq, key, batch=20):
 	"""
-	The following is:
-	http://code.activestate.com/recipes/576693/
-	Created by Raymond Hettinger on Wed, 18 Mar 2009 (MIT) 
-	Licensed under the MIT License
+	yield items of @seq with the largest @key first, in the same order
+	as sorted(seq, key=key, reverse=True)
+
+	The first @batch items are selected without sorting all of @seq,
+	further items in doubling batches, so that taking only the
+	first few items is cheap.
+
+	>>> list(largest_first([3, 1, 4, 1, 5, 9, 2, 6], key=abs, batch=3))
+	[9, 6, 5, 4, 3, 2, 1, 1]
+	>>> list(largest_first([(1, 'a'), (2, 'b'), (1, 'c'), (2, 'd')],
+	...                    key=lambda x: x[0], batch=1))
+	[(2, 'b'), (2, 'd'), (1, 'a'), (1, 'c')]
+	>>> list(largest_first([], key=abs))
+	[]
 	"""
+	seq = seq if isinstance(seq, list) else list(seq)
+	done = 0
+	while done < len(seq):
+		if batch * 2 >= len(seq):
+			selected = sorted(seq, key=key, reverse=True)
+		else:
+			selected = heapq.nlargest(batch, seq, key=key)
+		for item in itertools.islice(selected, done, None):
+			yield item
+		done = len(selected)
+		batch *= 2
 
-	class OrderedDict(dict, DictMixin):
-
-		def __init__(self, *args, **kwds):
-			if len(args) > 1:
-				raise TypeError('expected at most 1 arguments, got %d' % len(args))
-			try:
-				self.__end
-			except AttributeError:
-				self.clear()
-			self.update(*args, **kwds)
-
-		def clear(self):
-			self.__end = end = []
-			end += [None, end, end]         # sentinel node for doubly linked list
-			self.__map = {}                 # key --> [key, prev, next]
-			dict.clear(self)
-
-		def __setitem__(self, key, value):
-			if key not in self:
-				end = self.__end
-				curr = end[1]
-				curr[2] = end[1] = self.__map[key] = [key, curr, end]
-			dict.__setitem__(self, key, value)
-
-		def __delitem__(self, key):
-			dict.__delitem__(self, key)
-			key, prev, next = self.__map.pop(key)
-			prev[2] = next
-			next[1] = prev
-
-		def __iter__(self):
-			end = self.__end
-			curr = end[2]
-			while curr is not end:
-				yield curr[0]
-				curr = curr[2]
-
-		def __reversed__(self):
-			end = self.__end
-			curr = end[1]
-			while curr is not end:
-				yield curr[0]
-				curr = curr[1]
-
-		def popitem(self, last=True):
-			if not self:
-				raise KeyError('dictionary is empty')
-			if last:
-				key = reversed(self).next()
-			else:
-				key = iter(self).next()
-			value = self.pop(key)
-			return key, value
-
-		def __reduce__(self):
-			items = [[k, self[k]] for k in self]
-			tmp = self.__map, self.__end
-			del self.__map, self.__end
-			inst_dict = vars(self).copy()
-			self.__map, self.__end = tmp
-			if inst_dict:
-				return (self.__class__, (items,), inst_dict)
-			return self.__class__, (items,)
-
-		def keys(self):
-			return list(self)
-
-		setdefault = DictMixin.setdefault
-		update = DictMixin.update
-		pop = DictMixin.pop
-		values = DictMixin.values
-		items = DictMixin.items
-		iterkeys = DictMixin.iterkeys
-		itervalues = DictMixin.itervalues
-		iteritems = DictMixin.iteritems
-
-		def __repr__(self):
-			if not self:
-				return '%s()' % (self.__class__.__name__,)
-			return '%s(%r)' % (self.__class__.__name__, self.items())
-
-		def copy(self):
-			return self.__class__(self)
-
-		@classmethod
-		def fromkeys(cls, iterable, value=None):
-			d = cls()
-			for key in iterable:
-				d[key] = value
-			return d
-
-		def __eq__(self, other):
-			if isinstance(other, OrderedDict):
-				return len(self)==len(other) and self.items() == other.items()
-			return dict.__eq__(self, other)
-
-		def __ne__(self, other):
-			return not self == other
 
 class LruCache (object):
 	"""
 	Least-recently-used cache mapping of
-	size @maxsiz
+	size @maxsiz, or unlimited if @maxsiz is None
+
+	The items are kept in a circular doubly linked list, most recently
+	used last, so that a hit only relinks one node.
+
+	>>> cache = LruCache(2)
+	>>> cache["a"] = 1
+	>>> cache["b"] = 2
+	>>> cache["a"]
+	1
+	>>> cache["c"] = 3
+	>>> "b" in cache, cache.get("b"), cache.get("b", 0)
+	(False, None, 0)
+	>>> list(cache), len(cache)
+	(['a', 'c'], 2)
+	>>> cache.peek("a"), list(cache)
+	(1, ['a', 'c'])
+	>>> cache.pop("a")
+	1
+	>>> cache["b"]
+	Traceback (most recent call last):
+	    ...
+	KeyError: 'b'
 	"""
-	def __init__(self, maxsiz):
-		self.d = OrderedDict()
+	def __init__(self, maxsiz=None):
 		self.maxsiz = maxsiz
+		# key -> list node [prev, next, key, value]
+		self._links = {}
+		# the root's next node is the least recently used
+		self._root = root = []
+		root[:] = [root, root, None, None]
+
+	def __len__(self):
+		return len(self._links)
 
 	def __contains__(self, key):
-		return key in self.d
+		return key in self._links
 
-	def __setitem__(self, key, value):
-		self.d.pop(key, None)
-		self.d[key] = value
-		if len(self.d) > self.maxsiz:
-			# remove the first item (was inserted longest time ago)
-			lastkey = next(iter(self.d))
-			self.d.pop(lastkey)
+	def __iter__(self):
+		"""Iterate keys, least recently used first"""
+		root = self._root
+		link = root[1]
+		while link is not root:
+			yield link[2]
+			link = link[1]
+
+	def _touch(self, link):
+		"""Move @link to be the most recently used"""
+		link_prev, link_next = link[0], link[1]
+		link_prev[1] = link_next
+		link_next[0] = link_prev
+		root = self._root
+		last = root[0]
+		last[1] = root[0] = link
+		link[0] = last
+		link[1] = root
+
+	def get(self, key, default=None):
+		link = self._links.get(key)
+		if link is None:
+			return default
+		self._touch(link)
+		return link[3]
+
+	def peek(self, key, default=None):
+		"""Return the value for @key without marking it as used"""
+		link = self._links.get(key)
+		return default if link is None else link[3]
 
 	def __getitem__(self, key):
+		link = self._links[key]
+		self._touch(link)
+		return link[3]
+
+	def __setitem__(self, key, value):
+		link = self._links.get(key)
+		if link is not None:
+			link[3] = value
+			self._touch(link)
+			return
+		root = self._root
+		last = root[0]
+		link = [last, root, key, value]
+		last[1] = root[0] = self._links[key] = link
+		if self.maxsiz is not None and len(self._links) > self.maxsiz:
+			self.pop(root[1][2])
+
+	def pop(self, key, *default):
 		try:
-			value = self.d.pop(key)
+			link = self._links.pop(key)
 		except KeyError:
+			if default:
+				return default[0]
 			raise
-		# reinsert the value, puts it "last" in the order
-		self.d[key] = value
-		return value
+		link_prev, link_next = link[0], link[1]
+		link_prev[1] = link_next
+		link_next[0] = link_prev
+		return link[3]
+
+	def clear(self):
+		self._links.clear()
+		root = self._root
+		root[:] = [root, root, None, None]
 
 if __name__ == '__main__':
 	import doctest
@@ -0,0 +1,156 @@
+"""
+Crawl directory trees to a limited depth. Directories are read one
+at a time by default; reading them on worker threads is opt-in, since
+it only helps on slow or network filesystems.
+
+This module is a part of the program Kupfer, see the main program file for
+more information.
+"""
+
+import os
+import stat
+import threading
+import Queue
+
+from kupfer import pretty
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
+
+# number of threads to read directories in parallel, when asked for;
+# on a local disk the threads are held back by the GIL
+CRAWLER_WORKERS = 4
+
+def _list_directory_scandir(dirname):
+	"""Return a list of (name, is_dir) for @dirname"""
+	return [(entry.name, entry.is_dir(follow_symlinks=False))
+	        for entry in scandir(dirname)]
+
+def _list_directory_stat(dirname):
+	"""Return a list of (name, is_dir) for @dirname"""
+	entries = []
+	for name in os.listdir(dirname):
+		try:
+			mode = os.lstat(os.path.join(dirname, name)).st_mode
+		except OSError:
+			continue
+		entries.append((name, stat.S_ISDIR(mode)))
+	return entries
+
+list_directory = _list_directory_scandir if scandir else _list_directory_stat
+
+def _read_directory(dirname, depth, include_file):
+	"""Read @dirname at @depth
+
+	Return (paths, subdirs), where subdirs are (path, depth) of the
+	directories to descend into
+	"""
+	paths = []
+	subdirs = []
+	try:
+		entries = list_directory(dirname)
+	except OSError:
+		return paths, subdirs
+	for name, is_dir in entries:
+		if not include_file(name):
+			continue
+		abspath = os.path.join(dirname, name)
+		paths.append(abspath)
+		# symlinked directories are listed but not followed
+		if is_dir:
+			subdirs.append((abspath, depth + 1))
+	return paths, subdirs
+
+def _make_filter(include, exclude):
+	def include_file(name):
+		return ((not include or include(name)) and
+		        (not exclude or not exclude(name)))
+	return include_file
+
+def crawl(folder, depth=0, include=None, exclude=None,
+          workers=1, directories=None):
+	"""
+	Yield the absolute paths of files and directories in @folder,
+	and in its subdirectories down to @depth levels
+
+	include, exclude: a function returning a boolean
+	def include(filename):
+		return ShouldInclude
+
+	Excluded directories are not descended into. If @workers is more
+	than 1, directories are read by that many threads, started for this
+	crawl, and paths are yielded in no particular order.
+
+	If @directories is a list, the subdirectories that are read are
+	appended to it.
+	"""
+	include_file = _make_filter(include, exclude)
+	if directories is None:
+		directories = []
+	if depth <= 0 or workers <= 1:
+		return _crawl_serial(folder, depth, include_file, directories)
+	return _crawl_parallel(folder, depth, include_file, workers, directories)
+
+def _crawl_serial(folder, maxdepth, include_file, directories):
+	pending = [(folder, 0)]
+	while pending:
+		dirname, depth = pending.pop()
+		paths, subdirs = _read_directory(dirname, depth, include_file)
+		for path in paths:
+			yield path
+		if depth < maxdepth:
+			pending.extend(subdirs)
+			directories.extend(subdir for subdir, sdepth in subdirs)
+
+def _crawl_parallel(folder, maxdepth, include_file, workers, directories):
+	jobs = Queue.Queue()
+	results = Queue.Queue()
+
+	def worker():
+		while True:
+			job = jobs.get()
+			if job is None:
+				return
+			dirname, depth = job
+			try:
+				results.put(_read_directory(dirname, depth, include_file))
+			except Exception:
+				pretty.print_exc(__name__)
+				results.put(([], []))
+
+	threads = []
+	for i in xrange(workers):
+		thread = threading.Thread(target=worker)
+		thread.setDaemon(True)
+		thread.start()
+		threads.append(thread)
+
+	try:
+		jobs.put((folder, 0))
+		outstanding = 1
+		while outstanding:
+			paths, subdirs = results.get()
+			outstanding -= 1
+			for subdir in subdirs:
+				if subdir[1] <= maxdepth:
+					jobs.put(subdir)
+					directories.append(subdir[0])
+					outstanding += 1
+			for path in paths:
+				yield path
+	finally:
+		# also reached if the consumer stops early
+		try:
+			while True:
+				jobs.get_nowait()
+		except Queue.Empty:
+			pass
+		for thread in threads:
+			jobs.put(None)
+		for thread in threads:
+			thread.join()
@@ -0,0 +1,278 @@
+"""
+Caches of rendered icons: in memory, and kept between sessions.
+
+The memory cache is limited by the total size of the icons. The
+persistent cache stores icons as raw pixel data in one file, with an
+index at the start of the file. The file is memory-mapped when first
+used, so only the pixels of the icons that are looked up are read.
+
+This module is a part of the program Kupfer, see the main program file for
+more information.
+"""
+
+import marshal
+import mmap
+import os
+import struct
+
+from kupfer import datatools
+from kupfer import pretty
+
+# share of the cache that pinned icons may use
+PINNED_SHARE = 0.5
+
+class IconCache (object):
+	"""
+	Least-recently-used cache of icons, holding at most @max_bytes,
+	where @sizeof(icon) is the size of an icon
+
+	Pinned icons are evicted only by pinning other icons: at most
+	PINNED_SHARE of @max_bytes are pinned, and when that is exceeded
+	the least recently used pinned icons are unpinned.
+
+	>>> cache = IconCache(10)
+	>>> a, b, c = "a" * 4, "b" * 4, "c" * 4
+	>>> cache.put("a", a)
+	>>> cache.put("b", b)
+	>>> cache.get("a")
+	'aaaa'
+	>>> cache.put("c", c)
+	>>> cache.get("b") is None
+	True
+	>>> cache.pin("c")
+	>>> cache.put("b", b)
+	>>> cache.get("c"), cache.get("a")
+	('cccc', None)
+	>>> sorted(cache.get_statistics().items())
+	[('bytes', 8), ('entries', 2), ('evictions', 2), ('hits', 2), ('max_bytes', 10), ('misses', 2), ('pinned', 1), ('pinned_bytes', 4)]
+	>>> cache.pin("b")
+	>>> cache.get_statistics()["pinned"]
+	1
+	"""
+	def __init__(self, max_bytes, sizeof=len):
+		self.max_bytes = max_bytes
+		self.sizeof = sizeof
+		# key -> (icon, size), least recently used first
+		self._icons = datatools.LruCache()
+		self._pinned = datatools.LruCache()
+		self._bytes = 0
+		self._pinned_bytes = 0
+		self.hits = self.misses = self.evictions = 0
+
+	def get(self, key, default=None):
+		rec = self._pinned.get(key) or self._icons.get(key)
+		if rec is None:
+			self.misses += 1
+			return default
+		self.hits += 1
+		return rec[0]
+
+	def put(self, key, icon):
+		pinned = key in self._pinned
+		old = self._pinned.pop(key, None) or self._icons.pop(key, None)
+		if old is not None:
+			self._bytes -= old[1]
+			if pinned:
+				self._pinned_bytes -= old[1]
+		size = self.sizeof(icon)
+		self._icons[key] = (icon, size)
+		self._bytes += size
+		if pinned:
+			self.pin(key)
+		else:
+			self._evict()
+
+	def _evict(self):
+		icons = self._icons
+		while self._bytes > self.max_bytes and len(icons):
+			oldest = iter(icons).next()
+			self._bytes -= icons.pop(oldest)[1]
+			self.evictions += 1
+
+	def pin(self, key):
+		"""Keep the icon for @key, if it is in the cache"""
+		rec = self._icons.pop(key, None)
+		if rec is None:
+			return
+		self._pinned[key] = rec
+		self._pinned_bytes += rec[1]
+		self._unpin_to(self.max_bytes * PINNED_SHARE)
+
+	def _unpin_to(self, max_pinned_bytes):
+		"""Unpin the least recently used pinned icons until at most
+		@max_pinned_bytes are pinned"""
+		pinned = self._pinned
+		while self._pinned_bytes > max_pinned_bytes and len(pinned):
+			oldest = iter(pinned).next()
+			rec = pinned.pop(oldest)
+			self._pinned_bytes -= rec[1]
+			self._icons[oldest] = rec
+		self._evict()
+
+	def set_max_bytes(self, max_bytes):
+		self.max_bytes = max_bytes
+		self._unpin_to(max_bytes * PINNED_SHARE)
+
+	def clear(self):
+		"""Remove all icons, also pinned icons"""
+		self._icons.clear()
+		self._pinned.clear()
+		self._bytes = self._pinned_bytes = 0
+
+	def get_statistics(self):
+		return {
+			"entries": len(self._icons) + len(self._pinned),
+			"bytes": self._bytes,
+			"max_bytes": self.max_bytes,
+			"pinned": len(self._pinned),
+			"pinned_bytes": self._pinned_bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
+
+MAGIC = "KUPICON1"
+_HEADER = struct.Struct("<8sI")
+
+class IconDiskCache (pretty.OutputMixin):
+	"""
+	Icon pixel data saved in the file @filename, keyed by tuples of
+	marshallable values (strings, numbers)
+
+	Entries are tuples of (width, height, rowstride, has_alpha, pixels).
+	At most @max_bytes of pixel data are saved, the icons put in the
+	cache this session are saved first.
+
+	>>> import tempfile
+	>>> filename = tempfile.mktemp()
+	>>> cache = IconDiskCache(filename)
+	>>> cache.put(("folder", 24), 2, 1, 8, True, "\\xff" * 8)
+	>>> cache.save()
+	>>> cache = IconDiskCache(filename)
+	>>> cache.get(("folder", 24))
+	(2, 1, 8, True, '\\xff\\xff\\xff\\xff\\xff\\xff\\xff\\xff')
+	>>> cache.get(("folder", 48)) is None
+	True
+	>>> cache.clear()
+	>>> cache.get(("folder", 24)) is None
+	True
+	>>> os.path.exists(filename)
+	False
+	"""
+	def __init__(self, filename, max_bytes=8*1024*1024):
+		self.filename = filename
+		self.max_bytes = max_bytes
+		# key -> (offset, length, width, height, rowstride, has_alpha)
+		self._index = None
+		self._map = None
+		self._data_start = 0
+		# key -> entry, the icons to save
+		self._new = {}
+		self._new_order = []
+
+	def _load(self):
+		self._index = {}
+		try:
+			with open(self.filename, "rb") as fobj:
+				fmap = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+		except (EnvironmentError, ValueError):
+			# missing or empty file
+			return
+		try:
+			magic, index_len = _HEADER.unpack(fmap[:_HEADER.size])
+			if magic != MAGIC:
+				raise ValueError("Not an icon cache")
+			index = marshal.loads(fmap[_HEADER.size:_HEADER.size + index_len])
+			if not isinstance(index, dict):
+				raise ValueError("Invalid index")
+		except (struct.error, ValueError, EOFError, TypeError), exc:
+			self.output_info("Ignoring %s: %s" % (self.filename, exc))
+			fmap.close()
+			return
+		self._index = index
+		self._map = fmap
+		self._data_start = _HEADER.size + index_len
+		self.output_debug("Loaded %d icons" % len(index))
+
+	def get(self, key):
+		"""Return the entry for @key, or None"""
+		try:
+			return self._new[key]
+		except KeyError:
+			pass
+		if self._index is None:
+			self._load()
+		try:
+			offset, length, width, height, rowstride, alpha = self._index[key]
+		except KeyError:
+			return None
+		start = self._data_start + offset
+		return (width, height, rowstride, alpha, self._map[start:start+length])
+
+	def put(self, key, width, height, rowstride, has_alpha, pixels):
+		"""Store an entry for @key"""
+		if key not in self._new:
+			self._new_order.append(key)
+		self._new[key] = (width, height, rowstride, has_alpha, pixels)
+
+	def clear(self):
+		"""Remove all icons, also from the file"""
+		self._close()
+		self._index = {}
+		self._new.clear()
+		self._new_order = []
+		try:
+			os.unlink(self.filename)
+		except OSError:
+			pass
+
+	def _close(self):
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+
+	def _entries_to_save(self):
+		"""Yield (key, entry) of the icons to save"""
+		for key in reversed(self._new_order):
+			yield key, self._new[key]
+		for key in self._index or ():
+			if key not in self._new:
+				yield key, self.get(key)
+
+	def save(self):
+		"""Write the cache file, if any icons were added"""
+		if not self._new:
+			return
+		if self._index is None:
+			self._load()
+		index = {}
+		chunks = []
+		offset = 0
+		for key, (width, height, rowstride, alpha, pixels) in \
+				self._entries_to_save():
+			if offset + len(pixels) > self.max_bytes:
+				continue
+			index[key] = (offset, len(pixels), width, height, rowstride, alpha)
+			chunks.append(pixels)
+			offset += len(pixels)
+		index_data = marshal.dumps(index)
+		tmp_filename = "%s.%s" % (self.filename, os.getpid())
+		try:
+			with open(tmp_filename, "wb") as output:
+				output.write(_HEADER.pack(MAGIC, len(index_data)))
+				output.write(index_data)
+				for chunk in chunks:
+					output.write(chunk)
+			os.rename(tmp_filename, self.filename)
+		except EnvironmentError, exc:
+			self.output_error("Saving %s: %s" % (self.filename, exc))
+			return
+		self.output_debug("Saved %d icons" % len(index))
+		self._close()
+		self._index = None
+		self._new.clear()
+		self._new_order = []
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
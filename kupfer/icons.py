@@ -8,14 +8,20 @@ from gio import FILE_ATTRIBUTE_STANDARD_ICON, FILE_ATTRIBUTE_THUMBNAIL_PATH
 from gobject import GError
 
 from kupfer import config
-from kupfer import datatools
+from kupfer import iconcache
 from kupfer import pretty
 from kupfer import scheduler
 
-icon_cache = {}
+# default size of the icon cache in KiB, for icons of all sizes
+ICON_CACHE_KIB = 4096
 
-# number of elements in icon lru cache (per icon size)
-ICON_CACHE_SIZE = 15
+def _pixbuf_size(pixbuf):
+	return pixbuf.get_rowstride() * pixbuf.get_height()
+
+icon_cache = iconcache.IconCache(ICON_CACHE_KIB * 1024, sizeof=_pixbuf_size)
+
+# file in the cache directory to keep rendered icons in between sessions
+ICON_DISK_CACHE_FILE = "icons.cache"
 
 LARGE_SZ = 128
 SMALL_SZ = 24
@@ -33,10 +39,21 @@ kupfer_icon_fallbacks = {
 
 kupfer_locally_installed_names = set()
 
+_disk_cache = None
+_disk_cache_theme = None
+_theme_mtime = None
+
 def _icon_theme_changed(theme):
 	pretty.print_info(__name__, "Icon theme changed, clearing cache")
-	global icon_cache
-	icon_cache = {}
+	_clear_icon_cache()
+	if _disk_cache:
+		_disk_cache.clear()
+
+def _clear_icon_cache():
+	global _disk_cache_theme, _theme_mtime
+	icon_cache.clear()
+	_disk_cache_theme = None
+	_theme_mtime = None
 
 _default_theme = gtk.icon_theme_get_default()
 _default_theme.connect("changed", _icon_theme_changed)
@@ -91,26 +108,112 @@ def load_icon_from_func(plugin_name, icon_name, get_data_func, override=False):
 				"for", plugin_name)
 	kupfer_locally_installed_names.add(icon_name)
 
+def get_cached_icon(key, icon_size):
+	"""Return the icon for @key at @icon_size from the cache, or None"""
+	return icon_cache.get((key, icon_size))
+
 def get_icon(key, icon_size):
 	"""
 	try retrieve icon in cache
 	is a generator so it can be concisely called with a for loop
 	"""
-	try:
-		rec = icon_cache[icon_size][key]
-	except KeyError:
-		return
-	yield rec
+	rec = icon_cache.get((key, icon_size))
+	if rec is not None:
+		yield rec
 
 def store_icon(key, icon_size, icon):
 	"""
 	Store an icon in cache. It must not have been stored before
 	"""
 	assert icon, "icon %s may not be %s" % (key, icon)
-	icon_rec = icon
-	if icon_size not in icon_cache:
-		icon_cache[icon_size] = datatools.LruCache(ICON_CACHE_SIZE)
-	icon_cache[icon_size][key] = icon_rec
+	icon_cache.put((key, icon_size), icon)
+
+def pin_icon(key, icon_size):
+	"""Keep the icon for @key at @icon_size in the cache, if it is
+	cached"""
+	icon_cache.pin((key, icon_size))
+
+def get_gicon_key(gicon):
+	"""Return the key the icon for @gicon is cached as, or None"""
+	if isinstance(gicon, FileIcon):
+		return gicon.get_file().get_path()
+	if isinstance(gicon, ThemedIcon):
+		return gicon.get_names()[0]
+	return None
+
+def get_icon_cache_statistics():
+	"""Return a dictionary of the icon cache size and hit, miss and
+	eviction counts"""
+	return icon_cache.get_statistics()
+
+def _get_disk_cache():
+	global _disk_cache
+	if _disk_cache is None:
+		cache_home = config.get_cache_home()
+		if not cache_home:
+			return None
+		_disk_cache = iconcache.IconDiskCache(
+				os.path.join(cache_home, ICON_DISK_CACHE_FILE))
+		scheduler.GetScheduler().connect("finish", _save_disk_cache)
+	return _disk_cache
+
+def _save_disk_cache(sched):
+	_disk_cache.save()
+
+def _disk_cache_key(key, icon_size, mtime):
+	"""Return the key of the icon @key in the disk cache, which
+	depends on the current icon theme and renderer"""
+	global _disk_cache_theme
+	if _disk_cache_theme is None:
+		theme_name = gtk.settings_get_default().get_property(
+				"gtk-icon-theme-name")
+		_disk_cache_theme = "%s:%s" % (theme_name, _IconRenderer.__name__)
+	return (key, icon_size, _disk_cache_theme, mtime)
+
+def _get_theme_mtime():
+	"""Return the latest modification time of the directories of the
+	current icon theme, and of their icon caches
+
+	Installing icons changes it, so it is part of the disk cache key
+	of named icons.
+	"""
+	global _theme_mtime
+	if _theme_mtime is None:
+		theme_name = gtk.settings_get_default().get_property(
+				"gtk-icon-theme-name")
+		mtime = 0
+		for path in _default_theme.get_search_path():
+			for theme_dir in (path, os.path.join(path, theme_name),
+			                  os.path.join(path, "hicolor")):
+				for fpath in (theme_dir,
+				              os.path.join(theme_dir, "icon-theme.cache")):
+					try:
+						mtime = max(mtime, os.stat(fpath).st_mtime)
+					except OSError:
+						pass
+		_theme_mtime = mtime
+	return _theme_mtime
+
+def _load_icon_from_disk(key, icon_size, mtime=0):
+	"""Return the icon @key at @icon_size from the disk cache, or None"""
+	cache = _get_disk_cache()
+	entry = cache and cache.get(_disk_cache_key(key, icon_size, mtime))
+	if not entry:
+		return None
+	width, height, rowstride, has_alpha, pixels = entry
+	try:
+		return gtk.gdk.pixbuf_new_from_data(pixels, gtk.gdk.COLORSPACE_RGB,
+				has_alpha, 8, width, height, rowstride)
+	except (ValueError, TypeError):
+		pretty.print_exc(__name__)
+
+def _store_icon_on_disk(key, icon_size, icon, mtime=0):
+	cache = _get_disk_cache()
+	if not cache or icon.get_bits_per_sample() != 8:
+		return
+	cache.put(_disk_cache_key(key, icon_size, mtime), icon.get_width(),
+			icon.get_height(), icon.get_rowstride(), icon.get_has_alpha(),
+			icon.get_pixels())
 
 def _get_icon_dwim(icon, icon_size):
 	"""Make an icon at @icon_size where
@@ -280,6 +383,7 @@ def _get_icon_for_standard_gicon(gicon, icon_size):
 def _setup_icon_renderer(sched):
 	from kupfer.core import settings
 	setctl = settings.GetSettingsController()
+	icon_cache.set_max_bytes(setctl.get_config("Icons", "cachesize") * 1024)
 	setctl.connect("alternatives-changed::icon_renderer", _icon_render_change)
 	setctl.connect("value-changed::tools.icon_renderer", _icon_render_change)
 	_icon_render_change(setctl)
@@ -291,8 +395,8 @@ def _icon_render_change(setctl, *arguments):
 	if not renderer or renderer is _IconRenderer:
 		return
 	pretty.print_debug(__name__, "Using", renderer)
-	_icon_theme_changed(None)
 	_IconRenderer = renderer
+	_clear_icon_cache()
 
 scheduler.GetScheduler().connect("loaded", _setup_icon_renderer)
 
@@ -330,8 +434,14 @@ _IconRenderer = IconRenderer
 
 
 def get_icon_for_name(icon_name, icon_size, icon_names=[]):
-	for i in get_icon(icon_name, icon_size):
-		return i
+	icon = get_cached_icon(icon_name, icon_size)
+	if icon is not None:
+		return icon
+	theme_mtime = _get_theme_mtime()
+	icon = _load_icon_from_disk(icon_name, icon_size, theme_mtime)
+	if icon:
+		store_icon(icon_name, icon_size, icon)
+		return icon
 	if not icon_names: icon_names = (icon_name,)
 
 	# Try the whole list of given names
@@ -344,6 +454,7 @@ def get_icon_for_name(icon_name, icon_size, icon_names=[]):
 				fallback_name = kupfer_icon_fallbacks[icon_name]
 				icon = _IconRenderer.pixbuf_for_name(fallback_name, icon_size)
 				if icon:
+					load_name = fallback_name
 					break
 		except Exception:
 			pretty.print_exc(__name__)
@@ -354,15 +465,29 @@ def get_icon_for_name(icon_name, icon_size, icon_names=[]):
 	# We store the first icon in the list, even if the match
 	# found was later in the chain
 	store_icon(icon_name, icon_size, icon)
+	# but fallbacks are not kept between sessions, the icon
+	# may be installed later
+	if load_name == icon_name:
+		_store_icon_on_disk(icon_name, icon_size, icon, theme_mtime)
 	return icon
 
 def get_icon_from_file(icon_file, icon_size):
 	# try to load from cache
-	for icon in get_icon(icon_file, icon_size):
+	icon = get_cached_icon(icon_file, icon_size)
+	if icon is not None:
+		return icon
+	try:
+		mtime = os.stat(icon_file).st_mtime
+	except OSError:
+		mtime = 0
+	icon = _load_icon_from_disk(icon_file, icon_size, mtime)
+	if icon is not None:
+		store_icon(icon_file, icon_size, icon)
 		return icon
 	icon = _IconRenderer.pixbuf_for_file(icon_file, icon_size)
 	if icon is not None:
 		store_icon(icon_file, icon_size, icon)
+		_store_icon_on_disk(icon_file, icon_size, icon, mtime)
 		return icon
 
 def is_good(gicon):
@@ -5,6 +5,7 @@ class TextRepresentation (object):
 	Kupfer Objects that implement this interface have a plain text
 	representation that can be used for Copy & Paste etc
 	"""
+	__slots__ = ()
 	def get_text_representation(self):
 		"""The default implementation returns the represented object"""
 		return self.object
@@ -17,6 +18,7 @@ class UriListRepresentation (object):
 	get_urilist_representation should return a sequence of bytestring
 	URIs.
 	"""
+	__slots__ = ()
 	def get_urilist_representation(self):
 		"""The default implementation raises notimplementederror """
 		raise NotImplementedError
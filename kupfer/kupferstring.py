@@ -1,8 +1,11 @@
 # -*- encoding: UTF-8 -*-
 
 import locale
+import threading
 from unicodedata import normalize, category
 
+from kupfer import datatools
+
 def _folditems():
 	_folding_table = {
 		# general non-decomposing characters
@@ -57,6 +60,42 @@ def tolocale(ustr):
 	return ustr.encode(enc)
 
 
+# number of strings intern_unicode keeps in one generation, more than
+# the names of the largest catalogs; unicode strings can't be weakly
+# referenced, so when a generation is full, it is only kept until the
+# next one fills up, and the strings still in use are moved over
+INTERN_LIMIT = 100000
+_interned = {}
+_interned_old = {}
+
+def intern_unicode(ustr):
+	u"""Return a shared copy of the unicode string @ustr
+
+	Like intern(), which only takes bytestrings in Python 2, so that
+	many equal names (like README) use the memory of one.
+
+	>>> a = intern_unicode(u"README")
+	>>> intern_unicode(u"".join([u"READ", u"ME"])) is a
+	True
+	"""
+	global _interned, _interned_old
+	try:
+		return _interned[ustr]
+	except KeyError:
+		pass
+	shared = _interned_old.pop(ustr, ustr)
+	if len(_interned) >= INTERN_LIMIT:
+		_interned_old = _interned
+		_interned = {}
+	_interned[shared] = shared
+	return shared
+
+# number of folded strings to remember
+FOLD_CACHE_SIZE = 5000
+_folded_cache = datatools.LruCache(FOLD_CACHE_SIZE)
+# sources are also searched when rescanned in the background
+_folded_lock = threading.Lock()
+
 def tofolded(ustr):
 	u"""Fold @ustr
 
@@ -73,9 +112,26 @@ def tofolded(ustr):
 
 	>>> print tofolded(u"Ἑλλάς")
 	Ελλας
+
+	ASCII strings are returned as they are, other strings are
+	remembered once folded.
+
+	>>> tofolded(u"Wylacz")
+	u'Wylacz'
 	"""
-	srcstr = normalize("NFKD", ustr.translate(folding_table))
-	return u"".join([c for c in srcstr if category(c) != 'Mn'])
+	try:
+		ustr.encode("ascii")
+		return ustr
+	except UnicodeError:
+		pass
+	with _folded_lock:
+		folded = _folded_cache.get(ustr)
+	if folded is None:
+		srcstr = normalize("NFKD", ustr.translate(folding_table))
+		folded = u"".join([c for c in srcstr if category(c) != 'Mn'])
+		with _folded_lock:
+			_folded_cache[ustr] = folded
+	return folded
 
 if __name__ == '__main__':
 	import sys
@@ -2,7 +2,7 @@ from kupfer import datatools
 from kupfer import icons
 from kupfer import pretty
 from kupfer.utils import locale_sort
-from kupfer.kupferstring import tounicode, toutf8, tofolded
+from kupfer.kupferstring import tounicode, toutf8
 
 __all__ = [
 	"Error", "InvalidDataError", "OperationError", "InvalidLeafError",
@@ -59,6 +59,7 @@ class KupferObject (object):
 	icon; it must always be accessible.
 	"""
 	__metaclass__ = _BuiltinObject
+	__slots__ = ()
 	rank_adjust = 0
 	fallback_icon_name = "kupfer-object"
 	def __init__(self, name=None):
@@ -69,14 +70,12 @@ class KupferObject (object):
 		if not name:
 			name = self.__class__.__name__
 		self.name = tounicode(name)
-		folded_name = tofolded(self.name)
-		self.kupfer_add_alias(folded_name)
 
 	def kupfer_add_alias(self, alias):
 		if alias != unicode(self):
-			if not hasattr(self, "name_aliases"):
-				self.name_aliases = set()
-			self.name_aliases.add(alias)
+			aliases = getattr(self, "name_aliases", ())
+			if alias not in aliases:
+				self.name_aliases = aliases + (alias, )
 
 	def __str__(self):
 		return toutf8(self.name)
@@ -90,7 +89,8 @@ class KupferObject (object):
 		keys = " %s" % (key, ) if key else ""
 		if self._is_builtin:
 			return "<builtin.%s%s>" % (self.__class__.__name__, keys)
-		return "<%s.%s%s>" % (self.__module__, self.__class__.__name__, keys)
+		else:
+			return "<%s.%s%s>" % (self.__module__, self.__class__.__name__, keys)
 
 	def repr_key(self):
 		"""
@@ -98,6 +98,9 @@ class KupferObject (object):
 		self is returned by default.
 		This value is used to recognize objects, for example learning commonly
 		used objects.
+
+		The repr of a Leaf is computed again only when its name changes,
+		so the repr_key of a Leaf should not change otherwise.
 		"""
 		return self
 
@@ -173,19 +176,80 @@ class _NonpersistentToken (object):
 	def __reduce__(self):
 		return (sum, ((), None))
 
+_slot_names_cache = {}
+# slots that are caches, and not pickled
+_unpickled_slots = ("_repr_cache", "_index_entry")
+
+def _slot_names(cls):
+	"""Return the names of the __slots__ of @cls and its bases"""
+	try:
+		return _slot_names_cache[cls]
+	except KeyError:
+		pass
+	names = []
+	for klass in cls.__mro__:
+		slots = klass.__dict__.get("__slots__", ())
+		if isinstance(slots, basestring):
+			slots = (slots, )
+		names.extend(s for s in slots if s not in ("__dict__", "__weakref__"))
+	_slot_names_cache[cls] = names
+	return names
+
 class Leaf (KupferObject):
 	"""
 	Base class for objects
 
 	Leaf.object is the represented object (data)
 	All Leaves should be hashable (__hash__ and __eq__)
+
+	Leaves keep their attributes in __slots__, since sources can have
+	many thousands of them. Subclasses without __slots__ get a __dict__
+	as usual.
+
+	Leaf.name_aliases is a tuple, if set; use kupfer_add_alias()
+	to add an alias.
 	"""
+	# _index_entry: (name, aliases, search data) of the latest search,
+	# see kupfer.core.search
+	__slots__ = ("name", "name_aliases", "object", "_content_source",
+	             "_repr_cache", "_index_entry", "__weakref__")
 	def __init__(self, obj, name):
 		"""Represented object @obj and its @name"""
+		self._repr_cache = None
+		self._index_entry = None
 		super(Leaf, self).__init__(name)
 		self.object = obj
 		self._content_source = None
 
+	def __getstate__(self):
+		"""Return a dict of the attributes in __slots__ and __dict__"""
+		state = dict(getattr(self, "__dict__", ()))
+		for attr in _slot_names(type(self)):
+			if attr not in _unpickled_slots and hasattr(self, attr):
+				state[attr] = getattr(self, attr)
+		return state
+
+	def __setstate__(self, state):
+		"""Restore from @state, also when pickled before Leaf
+		used __slots__"""
+		self._repr_cache = None
+		self._index_entry = None
+		self._content_source = None
+		for attr, value in state.iteritems():
+			if attr == "name_aliases":
+				value = tuple(value)
+			setattr(self, attr, value)
+
+	def __repr__(self):
+		# The repr is used to identify leaves when ranking them, so it is
+		# cached for as long as the name stays the same
+		cached = self._repr_cache
+		if cached is not None and cached[0] is self.name:
+			return cached[1]
+		rep = KupferObject.__repr__(self)
+		self._repr_cache = (self.name, rep)
+		return rep
+
 	def __hash__(self):
 		return hash(unicode(self))
 
@@ -430,6 +494,16 @@ class Source (KupferObject, pretty.OutputMixin):
 				self.output_debug("Loaded items")
 		return self.cached_items
 
+	def get_leaf_sources(self):
+		"""
+		Return a sequence of the Sources whose leaves, taken together,
+		are the leaves of this Source, or None.
+
+		This allows the leaves of dynamic aggregating sources to be
+		indexed per source.
+		"""
+		return None
+
 	def has_parent(self):
 		return False
 
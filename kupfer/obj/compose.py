@@ -45,12 +45,12 @@ class ComposedLeaf (RunnableLeaf):
 		RunnableLeaf.__init__(self, object_, name)
 
 	def __getstate__(self):
-		state = dict(vars(self))
+		state = Leaf.__getstate__(self)
 		state["object"] = [puid.get_unique_id(o) for o in self.object]
 		return state
 
 	def __setstate__(self, state):
-		vars(self).update(state)
+		Leaf.__setstate__(self, state)
 		objid, actid, iobjid = state["object"]
 		obj = puid.resolve_unique_id(objid)
 		act = puid.resolve_action_id(actid, obj)
@@ -101,12 +101,12 @@ class MultipleLeaf (Leaf):
 		return self.object
 
 	def __getstate__(self):
-		state = dict(vars(self))
+		state = Leaf.__getstate__(self)
 		state["object"] = [puid.get_unique_id(o) for o in self.object]
 		return state
 
 	def __setstate__(self, state):
-		vars(self).update(state)
+		Leaf.__setstate__(self, state)
 		objects = []
 		for id_ in state["object"]:
 			obj = puid.resolve_unique_id(id_)
@@ -142,7 +142,8 @@ class GroupingSource (Source):
 			# adding the other's aliases can be misleading
 			# since the matched email address might not be
 			# what we are e-mailing
-			# obj.name_aliases.update(other.name_aliases)
+			# for alias in other.name_aliases:
+			# 	obj.kupfer_add_alias(alias)
 		return obj
 
 class ToplevelGroupingSource (GroupingSource):
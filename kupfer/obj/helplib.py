@@ -7,6 +7,8 @@ more information.
 
 import gio
 
+from kupfer.obj import validity
+
 class PicklingHelperMixin (object):
 	""" This pickling helper will define __getstate__/__setstate__
 	acting simply on the class dictionary; it is up to the inheriting
@@ -46,7 +48,15 @@ class NonpersistentToken (PicklingHelperMixin):
 		self.data = None
 
 class FilesystemWatchMixin (object):
-	"""A mixin for Sources watching directories"""
+	"""A mixin for Sources watching directories
+
+	By default any created or deleted file marks the Source for update,
+	Sources can instead handle the changes by overriding
+	monitor_file_created, monitor_file_deleted and monitor_file_moved.
+	Moves are reported as deletion and creation unless @monitor_moves
+	is set.
+	"""
+	monitor_moves = False
 
 	def monitor_directories(self, *directories, **kwargs):
 		"""Register @directories for monitoring;
@@ -62,11 +72,13 @@ class FilesystemWatchMixin (object):
 		"""
 		tokens = []
 		force = kwargs.get('force', False)
+		flags = (gio.FILE_MONITOR_SEND_MOVED if self.monitor_moves
+		         else gio.FILE_MONITOR_NONE)
 		for directory in directories:
 			gfile = gio.File(directory)
 			if not force and not gfile.query_exists():
 				continue
-			monitor = gfile.monitor_directory(gio.FILE_MONITOR_NONE, None)
+			monitor = gfile.monitor_directory(flags, None)
 			if monitor:
 				monitor.connect("changed", self.__directory_changed)
 				tokens.append(monitor)
@@ -78,11 +90,37 @@ class FilesystemWatchMixin (object):
 		"""
 		return not (gfile and gfile.get_basename().startswith("."))
 
+	def monitor_file_created(self, gfile):
+		"""@gfile was created in a monitored directory"""
+		self.mark_for_update()
+
+	def monitor_file_deleted(self, gfile):
+		"""@gfile was deleted from a monitored directory"""
+		self.mark_for_update()
+
+	def monitor_file_moved(self, gfile, dest_gfile):
+		"""@gfile was moved to @dest_gfile, only called if @monitor_moves
+
+		Either of the files may be excluded by monitor_include_file
+		"""
+		self.mark_for_update()
+
 	def __directory_changed(self, monitor, file1, file2, evt_type):
-		if (evt_type in (gio.FILE_MONITOR_EVENT_CREATED,
-				gio.FILE_MONITOR_EVENT_DELETED) and
-				self.monitor_include_file(file1)):
-			self.mark_for_update()
+		if evt_type in (gio.FILE_MONITOR_EVENT_CREATED,
+				gio.FILE_MONITOR_EVENT_DELETED, gio.FILE_MONITOR_EVENT_MOVED):
+			for gfile in (file1, file2):
+				if gfile and gfile.get_path():
+					validity.invalidate(gfile.get_path())
+		if evt_type == gio.FILE_MONITOR_EVENT_MOVED:
+			if (self.monitor_include_file(file1) or
+					self.monitor_include_file(file2)):
+				self.monitor_file_moved(file1, file2)
+		elif not self.monitor_include_file(file1):
+			return
+		elif evt_type == gio.FILE_MONITOR_EVENT_CREATED:
+			self.monitor_file_created(file1)
+		elif evt_type == gio.FILE_MONITOR_EVENT_DELETED:
+			self.monitor_file_deleted(file1)
 
 def reverse_action(action, rank=0):
 	"""Return a reversed version a three-part action
@@ -20,7 +20,7 @@ from kupfer.obj.base import Leaf, Action
 from kupfer.obj.base import InvalidDataError, OperationError
 from kupfer.obj import fileactions
 from kupfer.interface import TextRepresentation
-from kupfer.kupferstring import tounicode
+from kupfer.kupferstring import tounicode, intern_unicode
 
 def ConstructFileLeafTypes():
 	""" Return a seq of the Leaf types returned by ConstructFileLeaf"""
@@ -48,6 +48,7 @@ class FileLeaf (Leaf, TextRepresentation):
 	"""
 	Represents one file: the represented object is a bytestring (important!)
 	"""
+	__slots__ = ("_identity", )
 	serializable = 1
 
 	def __init__(self, obj, name=None, alias=None):
@@ -64,16 +65,35 @@ class FileLeaf (Leaf, TextRepresentation):
 		# Use glib filename reading to make display name out of filenames
 		# this function returns a `unicode` object
 		if not name:
-			name = gobject.filename_display_basename(obj)
+			name = intern_unicode(gobject.filename_display_basename(obj))
 		super(FileLeaf, self).__init__(obj, name)
 		if alias:
 			self.kupfer_add_alias(alias)
 
+	def _get_identity(self):
+		"""Return the normalized path of the file, which identifies it
+		for hashing and equality without touching the file system"""
+		try:
+			return self._identity
+		except AttributeError:
+			identity = path.normpath(path.abspath(self.object))
+			# share the path string when it is already normalized
+			self._identity = self.object if identity == self.object else identity
+			return self._identity
+
+	def __hash__(self):
+		return hash(self._get_identity())
+
 	def __eq__(self, other):
+		return (type(self) == type(other) and
+				self._get_identity() == other._get_identity() and
+				unicode(self) == unicode(other))
+
+	def is_same_file(self, other):
+		"""Return whether the FileLeaf @other refers to the same file
+		on disk, also through symlinks or hard links"""
 		try:
-			return (type(self) == type(other) and
-					unicode(self) == unicode(other) and
-					path.samefile(self.object, other.object))
+			return path.samefile(self.object, other.object)
 		except OSError, exc:
 			pretty.print_debug(__name__, exc)
 			return False
@@ -185,13 +205,13 @@ class AppLeaf (Leaf):
 
 	def __getstate__(self):
 		self.init_item_id = self.object and self.object.get_id()
-		state = dict(vars(self))
+		state = Leaf.__getstate__(self)
 		state["object"] = None
 		state["init_item"] = None
 		return state
 
 	def __setstate__(self, state):
-		vars(self).update(state)
+		Leaf.__setstate__(self, state)
 		self.finish()
 
 	def finish(self, require_x=False):
@@ -351,6 +371,7 @@ class CloseAll (Action):
 		return "window-close"
 
 class UrlLeaf (Leaf, TextRepresentation):
+	__slots__ = ()
 	def __init__(self, obj, name):
 		super(UrlLeaf, self).__init__(obj, name or obj)
 		if obj != name:
@@ -1,20 +1,138 @@
 import itertools
 import os
 from os import path
+import threading
 
 import gobject
 
 from kupfer import datatools
+from kupfer import dircrawler
 from kupfer import icons
 from kupfer import utils
 
 from kupfer.obj.base import Source
 from kupfer.obj.helplib import PicklingHelperMixin, FilesystemWatchMixin
+from kupfer.obj.helplib import NonpersistentToken
 from kupfer.obj.objects import FileLeaf, SourceLeaf
 from kupfer.obj.objects import ConstructFileLeaf, ConstructFileLeafTypes
 
 
-class FileSource (Source):
+# the most directories one FileSource monitors
+FILE_MONITOR_LIMIT = 256
+
+def _leaf_path(leaf):
+	"""Return the path @leaf was constructed from by ConstructFileLeaf"""
+	return getattr(leaf, "init_path", None) or leaf.object
+
+class FileIndexMixin (FilesystemWatchMixin):
+	"""A mixin for Sources of file leaves
+
+	Applies the changes reported by the directory monitors to the
+	cached leaves, using an index of the leaves by path, instead of
+	marking the Source for update.
+
+	The inheriting class must implement:
+	make_file_leaves(path):
+		Return the leaves to add for the new file @path
+	and may implement:
+	is_indexed_directory(path):
+		Return whether there are leaves inside the directory @path
+	"""
+	monitor_moves = True
+
+	def is_indexed_directory(self, path):
+		return False
+
+	def _get_file_index(self):
+		"""Return the path index of the cached leaves, or None
+		if the leaves are not loaded"""
+		items = self.cached_items
+		if items is None:
+			return None
+		token = getattr(self, "_file_index", None)
+		if token is None or token.data is None or token.data[0] is not items:
+			index = dict((_leaf_path(leaf), leaf) for leaf in items)
+			token = self._file_index = NonpersistentToken((items, index))
+		return token.data[1]
+
+	def _paths_below(self, index, path):
+		"""Return the paths of @index inside the directory @path"""
+		prefix = os.path.join(path, "")
+		return [p for p in index if p.startswith(prefix)]
+
+	def change_file_index(self, removed=(), added=()):
+		"""Remove the leaves at the paths @removed, along with any leaves
+		inside them, and add the leaves @added to the cached leaves
+
+		The cached leaves are replaced by a new list, so that users
+		holding on to the previous list see that it changed.
+		"""
+		index = self._get_file_index()
+		if index is None:
+			return
+		removed_leaves = []
+		for rpath in removed:
+			lpaths = [rpath]
+			if self.is_indexed_directory(rpath):
+				lpaths.extend(self._paths_below(index, rpath))
+			for lpath in lpaths:
+				if lpath in index:
+					removed_leaves.append(index.pop(lpath))
+		for leaf in added:
+			lpath = _leaf_path(leaf)
+			if lpath in index:
+				removed_leaves.append(index.pop(lpath))
+			index[lpath] = leaf
+		if not removed_leaves and not added:
+			return
+
+		items = list(self.cached_items)
+		sort = self.should_sort_lexically()
+		for leaf in removed_leaves:
+			_remove_leaf(items, leaf, sort)
+		for leaf in added:
+			if sort:
+				utils.locale_insort(items, leaf)
+			else:
+				items.append(leaf)
+		self.cached_items = items
+		self._file_index = NonpersistentToken((items, index))
+		self.output_debug("Updated items: %d removed, %d added" %
+		                  (len(removed_leaves), len(added)))
+
+	def monitor_file_created(self, gfile):
+		self.change_file_index(added=self.make_file_leaves(gfile.get_path()))
+
+	def monitor_file_deleted(self, gfile):
+		self.change_file_index(removed=(gfile.get_path(), ))
+
+	def monitor_file_moved(self, gfile, dest_gfile):
+		removed = added = ()
+		if self.monitor_include_file(gfile):
+			removed = (gfile.get_path(), )
+		if self.monitor_include_file(dest_gfile):
+			added = self.make_file_leaves(dest_gfile.get_path())
+		self.change_file_index(removed, added)
+
+def _remove_leaf(items, leaf, sort):
+	"""Remove @leaf, by identity, from the list @items"""
+	if sort:
+		# look among the items sorting equal to @leaf
+		idx = utils.locale_bisect(items, leaf) - 1
+		key = unicode(leaf)
+		while idx >= 0 and unicode(items[idx]) == key:
+			if items[idx] is leaf:
+				del items[idx]
+				return
+			idx -= 1
+	for idx, item in enumerate(items):
+		if item is leaf:
+			del items[idx]
+			return
+
+class FileSource (Source, FileIndexMixin):
+	_monitors = None
+
 	def __init__(self, dirlist, depth=0):
 		"""
 		@dirlist: Directories as byte strings
@@ -31,18 +149,94 @@ class FileSource (Source):
 			self.__class__.__name__,
 			', '.join('"%s"' % d for d in sorted(self.dirlist)), self.depth)
 
-	def get_items(self):
-		iters = []
-		
-		def mkleaves(directory):
-			files = utils.get_dirlist(directory, depth=self.depth,
-					exclude=self._exclude_file)
-			return (ConstructFileLeaf(f) for f in files)
+	def _get_directories(self):
+		"""Return the directories of the source, normalized like the
+		paths of monitored files"""
+		return [path.normpath(d) for d in self.dirlist]
 
-		for d in self.dirlist:
-			iters.append(mkleaves(d))
+	def initialize(self):
+		# subdirectories are monitored when they are first crawled
+		self._monitors = {}
+		self._monitor_directories(self._get_directories())
 
-		return itertools.chain(*iters)
+	def finalize(self):
+		self._monitors = None
+
+	def _monitor_directories(self, dirnames):
+		"""Monitor @dirnames, up to FILE_MONITOR_LIMIT directories"""
+		if self._monitors is None:
+			return
+		for dirname in dirnames:
+			if dirname in self._monitors:
+				continue
+			if len(self._monitors) >= FILE_MONITOR_LIMIT:
+				self.output_debug("Not monitoring more than %d directories" %
+				                  FILE_MONITOR_LIMIT)
+				break
+			self._monitors[dirname] = self.monitor_directories(dirname)
+
+	def _unmonitor_tree(self, directory):
+		prefix = path.join(directory, "")
+		for dirname in list(self._monitors or ()):
+			if dirname == directory or dirname.startswith(prefix):
+				for monitor in self._monitors.pop(dirname).data or ():
+					monitor.cancel()
+
+	def _subdirectory_depth(self, dirpath):
+		"""Return how many levels below @dirpath are included,
+		or -1 if the contents of @dirpath are not included"""
+		for d in self._get_directories():
+			prefix = path.join(d, "")
+			if dirpath.startswith(prefix):
+				return self.depth - dirpath[len(prefix):].count(os.sep) - 1
+		return -1
+
+	def is_indexed_directory(self, dirpath):
+		return self._subdirectory_depth(dirpath) >= 0
+
+	def make_file_leaves(self, filepath):
+		depth = self._subdirectory_depth(filepath)
+		if (depth >= 0 and self._monitors is not None and
+				path.isdir(filepath) and not path.islink(filepath)):
+			# a new directory may be a large tree, crawl it in a thread
+			thread = threading.Thread(target=self._crawl_new_directory,
+			                          args=(filepath, depth))
+			thread.setDaemon(True)
+			thread.start()
+		return [ConstructFileLeaf(filepath)]
+
+	def _crawl_new_directory(self, dirpath, depth):
+		subdirs = []
+		leaves = [ConstructFileLeaf(f) for f in dircrawler.crawl(dirpath,
+				depth=depth, exclude=self._exclude_file, directories=subdirs)]
+		gobject.idle_add(self._add_new_directory, dirpath, leaves, subdirs)
+
+	def _add_new_directory(self, dirpath, leaves, subdirs):
+		"""Add @leaves and monitor @subdirs, crawled in the new
+		directory @dirpath"""
+		index = self._get_file_index()
+		if self._monitors is None or index is None or dirpath not in index:
+			# removed meanwhile
+			return
+		self._monitor_directories([dirpath] + subdirs)
+		self.change_file_index(added=leaves)
+
+	def monitor_file_deleted(self, gfile):
+		FileIndexMixin.monitor_file_deleted(self, gfile)
+		self._unmonitor_tree(gfile.get_path())
+
+	def monitor_file_moved(self, gfile, dest_gfile):
+		FileIndexMixin.monitor_file_moved(self, gfile, dest_gfile)
+		self._unmonitor_tree(gfile.get_path())
+
+	def get_items(self):
+		subdirs = []
+		for d in self._get_directories():
+			for f in dircrawler.crawl(d, depth=self.depth,
+					exclude=self._exclude_file, directories=subdirs):
+				yield ConstructFileLeaf(f)
+		# the crawl runs in the rescanner, monitor in the main thread
+		gobject.idle_add(self._monitor_directories, subdirs)
 
 	def should_sort_lexically(self):
 		return True
@@ -60,7 +254,7 @@ class FileSource (Source):
 	def provides(self):
 		return ConstructFileLeafTypes()
 
-class DirectorySource (Source, PicklingHelperMixin, FilesystemWatchMixin):
+class DirectorySource (Source, PicklingHelperMixin, FileIndexMixin):
 	def __init__(self, dir, show_hidden=False):
 		# Use glib filename reading to make display name out of filenames
 		# this function returns a `unicode` object
@@ -82,11 +276,15 @@ class DirectorySource (Source, PicklingHelperMixin, FilesystemWatchMixin):
 	def monitor_include_file(self, gfile):
 		return self.show_hidden or not gfile.get_basename().startswith('.')
 
+	def make_file_leaves(self, filepath):
+		return [ConstructFileLeaf(filepath)]
+
 	def get_items(self):
+		directory = path.normpath(self.directory)
 		try:
-			for fname in os.listdir(self.directory):
+			for fname in os.listdir(directory):
 				if self.show_hidden or not fname.startswith("."):
-					yield ConstructFileLeaf(path.join(self.directory, fname))
+					yield ConstructFileLeaf(path.join(directory, fname))
 		except OSError, exc:
 			self.output_error(exc)
 
@@ -166,13 +364,16 @@ class MultiSource (Source):
 
 	def get_items(self):
 		iterators = []
-		ui = datatools.UniqueIterator(S.toplevel_source() for S in self.sources)
-		for S in ui:
+		for S in self.get_leaf_sources():
 			it = S.get_leaves()
 			iterators.append(it)
 
 		return itertools.chain(*iterators)
 
+	def get_leaf_sources(self):
+		return list(datatools.UniqueIterator(S.toplevel_source()
+		                                     for S in self.sources))
+
 	def get_description(self):
 		return _("Root catalog")
 
@@ -0,0 +1,81 @@
+"""
+A short-lived cache of KupferObject.is_valid() results.
+
+Checking validity may need a system call (for FileLeaf it is an
+access() call), and search results are checked again every time they
+are accessed. The results are kept for VALID_CACHE_TTL seconds, or
+until a monitored directory reports a change to their path. The objects
+are weakly referenced, so the cache does not keep removed objects alive.
+
+This module is a part of the program Kupfer, see the main program file for
+more information.
+"""
+
+import os
+import time
+import weakref
+
+# seconds to trust a validity check
+VALID_CACHE_TTL = 3
+# number of cached results to keep before pruning expired ones
+VALID_CACHE_SIZE = 2000
+
+# object -> (valid, time checked)
+_cache = weakref.WeakKeyDictionary()
+
+def _check(obj, now):
+	try:
+		valid, checked = _cache[obj]
+		if now - checked < VALID_CACHE_TTL:
+			return valid
+	except KeyError:
+		if len(_cache) >= VALID_CACHE_SIZE:
+			_prune(now)
+	except TypeError:
+		# not weakly referable
+		return obj.is_valid()
+	valid = obj.is_valid()
+	_cache[obj] = (valid, now)
+	return valid
+
+def _prune(now):
+	for obj, (valid, checked) in _cache.items():
+		if now - checked >= VALID_CACHE_TTL:
+			del _cache[obj]
+	if len(_cache) >= VALID_CACHE_SIZE:
+		_cache.clear()
+
+def is_valid(obj):
+	"""Return whether @obj is valid; objects without is_valid()
+	are always valid"""
+	if not hasattr(obj, "is_valid"):
+		return True
+	return _check(obj, time.time())
+
+def filter_valid(objects, key=None):
+	"""Return a list of the valid items of @objects, checking them
+	all at once
+
+	@key: function returning the object to check for each item
+	"""
+	now = time.time()
+	valid = []
+	for item in objects:
+		obj = key(item) if key else item
+		if not hasattr(obj, "is_valid") or _check(obj, now):
+			valid.append(item)
+	return valid
+
+def invalidate(path=None):
+	"""Forget the validity checks of the objects representing @path,
+	or a path inside it, for example after it was created or removed;
+	or all checks if no @path is given"""
+	if path is None:
+		_cache.clear()
+		return
+	prefix = os.path.join(path, "")
+	for obj in _cache.keys():
+		opath = getattr(obj, "object", None)
+		if (isinstance(opath, basestring) and
+				(opath == path or opath.startswith(prefix))):
+			_cache.pop(obj, None)
@@ -29,10 +29,12 @@ class DebugInfo (Action):
 
 	def activate(self, leaf):
 		import StringIO
+		import time
 		# NOTE: Core imports
-		from kupfer.core import qfurl
+		from kupfer.core import qfurl, sources
 		from kupfer import uiutils
 		from kupfer import puid
+		from kupfer import icons
 
 		output = StringIO.StringIO()
 		def print_func(*args):
@@ -98,6 +100,15 @@ class DebugInfo (Action):
 		if leafinfo["content"] != leafinfo["content-alt"]:
 			print_func("Content-Alt ========")
 			print_fields(get_source_fields(leafinfo["content-alt"]))
+		print_func("Icon cache =========")
+		print_fields(icons.get_icon_cache_statistics())
+		print_func("Rescan schedule ====")
+		rescanner = sources.GetSourceController().rescanner
+		now = time.time()
+		for src, rescan_time, record in rescanner.get_schedule():
+			print_func("%6d s, every %6d s, %d/%d changed, %.2f s:" %
+			           (rescan_time - now, record.interval, record.changes,
+			            record.rescans, record.cost), src)
 		uiutils.show_text_result(output.getvalue())
 
 	def get_description(self):
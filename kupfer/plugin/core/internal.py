@@ -39,15 +39,13 @@ class LastResultObject (Leaf):
 	"dummy superclass"
 
 def _make_first_result_object(leaf):
-	global LastResultObject
-	class LastResultObject (LastResultObject):
+	class LastResult (leaf.__class__, LastResultObject):
 		qf_id = "lastresult"
 		def __init__(self, leaf):
 			Leaf.__init__(self, leaf.object, _("Last Result"))
-			vars(self).update(vars(leaf))
+			Leaf.__setstate__(self, Leaf.__getstate__(leaf))
 			self.name = _("Last Result")
 			self.__orignal_leaf = leaf
-			self.__class__.__bases__ = (leaf.__class__, Leaf)
 
 		def get_gicon(self):
 			return None
@@ -58,7 +56,7 @@ def _make_first_result_object(leaf):
 		def get_description(self):
 			return unicode(self.__orignal_leaf)
 
-	return LastResultObject(leaf)
+	return LastResult(leaf)
 
 
 class CommandResults (Source):
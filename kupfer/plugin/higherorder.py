@@ -51,14 +51,13 @@ def _save_result(cleaf):
 	leaf = _exec_no_show_result(cleaf)
 	if leaf is None:
 		return None
-	class ResultObject (Leaf):
+	class ResultObject (leaf.__class__):
 		serializable = 1
 		def __init__(self, leaf, cleaf):
 			Leaf.__init__(self, leaf.object, unicode(leaf))
-			vars(self).update(vars(leaf))
+			Leaf.__setstate__(self, Leaf.__getstate__(leaf))
 			self.name = _("Result of %s (%s)") % (cleaf, self)
 			self.__composed_leaf = cleaf
-			self.__class__.__bases__ = (leaf.__class__, Leaf)
 
 		def get_gicon(self):
 			return None
@@ -17,6 +17,7 @@ from kupfer import version
 
 from kupfer import scheduler
 from kupfer.ui import accelerators
+from kupfer.ui import iconloader
 from kupfer.ui import keybindings
 from kupfer.ui import listen
 from kupfer.ui import uievents
@@ -128,6 +129,7 @@ class LeafModel (object):
 		self.store = gtk.ListStore(gobject.TYPE_PYOBJECT, *columns)
 		self.object_column = 0
 		self.base = None
+		self._icon_token = iconloader.RequestToken()
 		self._setup_columns()
 
 	def __len__(self):
@@ -194,6 +196,8 @@ class LeafModel (object):
 		"""Clear the model and reset its base"""
 		self.store.clear()
 		self.base = None
+		self._icon_token.cancel()
+		self._icon_token = iconloader.RequestToken()
 
 	def set_base(self, baseiter):
 		self.base = iter(baseiter)
@@ -227,18 +231,44 @@ class LeafModel (object):
 		return (rankable, icon, markup, info, rank_str)
 
 	def add(self, rankable):
-		self.store.append(self._get_row(rankable))
+		priority = len(self.store)
+		treeiter = self.store.append(self._get_row(rankable))
+		self._request_icon(rankable.object, treeiter, priority)
 
 	def add_first(self, rankable):
-		self.store.prepend(self._get_row(rankable))
+		treeiter = self.store.prepend(self._get_row(rankable))
+		self._request_icon(rankable.object, treeiter, 0)
+
+	def _request_icon(self, leaf, treeiter, priority):
+		"""Load the icon of @leaf in the background and put it in
+		the row at @treeiter when ready"""
+		sz = self.get_icon_size()
+		if sz < 8:
+			return
+		row_ref = gtk.TreeRowReference(self.store,
+				self.store.get_path(treeiter))
+		def set_icon(pbuf):
+			if pbuf and row_ref.valid():
+				treeiter = self.store.get_iter(row_ref.get_path())
+				self.store.set_value(treeiter, self.icon_col, pbuf)
+		iconloader.GetIconLoader().request(leaf, sz, priority,
+				self._icon_token, set_icon)
 
 	def get_icon_size(self):
 		return gtk.icon_size_lookup(gtk.icon_size_from_name("kupfer-small"))[0]
 
 	def get_icon(self, leaf):
+		"""Return the icon of the row of @leaf when it is added
+
+		The icon of @leaf is loaded in the background, so this is
+		the placeholder icon."""
+		return self.get_placeholder_icon(leaf)
+
+	def get_placeholder_icon(self, leaf):
+		"""Return the icon to show until the icon of @leaf is loaded"""
 		sz = self.get_icon_size()
 		if sz >= 8:
-			return leaf.get_thumbnail(sz, sz) or leaf.get_pixbuf(sz)
+			return icons.get_icon_for_name(leaf.fallback_icon_name, sz)
 
 	def get_label_markup(self, rankable):
 		leaf = rankable.object
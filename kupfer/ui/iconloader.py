@@ -0,0 +1,134 @@
+"""
+Load the icons of result list rows in the background.
+
+Rows are shown with a placeholder icon first. The thumbnail of a file,
+or the icon file of a GIcon, is read and decoded by a small pool of
+worker threads, first rows first, and the icon is patched into the row
+in the main thread when it is ready. The icon theme is not thread safe,
+and plugins don't expect get_thumbnail() to be called in a thread, so
+GIcons are looked up, themed icons rendered and other thumbnails loaded
+in the main thread.
+
+This module is a part of the program Kupfer, see the main program file for
+more information.
+"""
+
+import itertools
+import threading
+import Queue
+
+import gio
+import gobject
+
+from kupfer import icons
+from kupfer import pretty
+from kupfer.core import learn
+from kupfer.obj.base import KupferObject
+from kupfer.obj.objects import FileLeaf
+
+# number of threads looking up icons
+ICON_WORKERS = 2
+
+# keep the icons of objects with at least this learned score in the
+# icon cache
+PIN_ICON_SCORE = 40
+
+class RequestToken (object):
+	"""Groups icon requests, so that they can be cancelled together"""
+	cancelled = False
+	def cancel(self):
+		self.cancelled = True
+
+class IconLoader (pretty.OutputMixin):
+	"""
+	Look up icons in worker threads, lowest priority number first
+
+	Requests whose token is cancelled are dropped without lookup.
+	"""
+	def __init__(self, workers=ICON_WORKERS):
+		self._queue = Queue.PriorityQueue()
+		self._counter = itertools.count()
+		self._workers = workers
+		self._threads = []
+
+	def request(self, obj, size, priority, token, callback):
+		"""Look up the icon for @obj at @size
+
+		@callback is called in the main thread with the pixbuf, unless
+		@token is cancelled first.
+		"""
+		if not self._threads:
+			self._start_workers()
+		job = (obj, size, obj.get_gicon(), token, callback)
+		self._queue.put((priority, self._counter.next(), job))
+
+	def _start_workers(self):
+		for i in xrange(self._workers):
+			thread = threading.Thread(target=self._worker)
+			thread.setDaemon(True)
+			thread.start()
+			self._threads.append(thread)
+
+	def _worker(self):
+		while True:
+			job = self._queue.get()[-1]
+			obj, size, gicon, token, callback = job
+			if token.cancelled:
+				continue
+			try:
+				found = _load_icon(obj, size, gicon)
+			except Exception:
+				self.output_exc()
+				found = None
+			gobject.idle_add(self._finish, job, found)
+
+	def _finish(self, job, found):
+		obj, size, gicon, token, callback = job
+		if token.cancelled:
+			return
+		if not found and not _thumbnail_in_thread(obj):
+			found = obj.get_thumbnail(size, size)
+		pbuf = found
+		if not pbuf and gicon:
+			pbuf = icons.get_icon_for_gicon(gicon, size)
+			key = icons.get_gicon_key(gicon)
+		if not pbuf:
+			pbuf = obj.get_pixbuf(size)
+			key = obj.get_icon_name()
+		if pbuf and not found and key and \
+				learn.get_record_score(obj) >= PIN_ICON_SCORE:
+			icons.pin_icon(key, size)
+		callback(pbuf)
+
+# the get_thumbnail() implementations known to be safe in a thread
+_THREAD_SAFE_THUMBNAILS = (KupferObject.get_thumbnail.im_func,
+                           FileLeaf.get_thumbnail.im_func)
+
+def _thumbnail_in_thread(obj):
+	"""Whether the thumbnail of @obj may be loaded in a worker thread"""
+	method = getattr(type(obj), "get_thumbnail", None)
+	return getattr(method, "im_func", None) in _THREAD_SAFE_THUMBNAILS
+
+def _load_icon(obj, size, gicon):
+	"""Return the thumbnail of @obj if it can be loaded in a thread,
+	or the icon of @gicon if it is an icon file, or None
+
+	Runs in a worker thread, so must not use the icon theme
+	"""
+	if _thumbnail_in_thread(obj):
+		thumbnail = obj.get_thumbnail(size, size)
+		if thumbnail:
+			return thumbnail
+	if isinstance(gicon, gio.FileIcon):
+		return icons.get_pixbuf_from_file(gicon.get_file().get_path(),
+		                                  size, size)
+	return None
+
+_icon_loader = None
+
+def GetIconLoader():
+	"""Get the shared IconLoader"""
+	global _icon_loader
+	if _icon_loader is None:
+		_icon_loader = IconLoader()
+	return _icon_loader
@@ -10,6 +10,7 @@ import glib
 
 
 from kupfer import pretty
+from kupfer import dircrawler
 from kupfer import kupferstring
 from kupfer import desktop_launch
 from kupfer import launch
@@ -26,39 +27,8 @@ def get_dirlist(folder, depth=0, include=None, exclude=None):
 	def include(filename):
 		return ShouldInclude
 	"""
-	from os import walk
-	paths = []
-	def include_file(file):
-		return (not include or include(file)) and (not exclude or not exclude(file))
-		
-	for dirname, dirnames, fnames in walk(folder):
-		# skip deep directories
-		head, dp = dirname, 0
-		while not os_path.samefile(head, folder):
-			head, tail = os_path.split(head)
-			dp += 1
-		if dp > depth:
-			del dirnames[:]
-			continue
-		
-		excl_dir = []
-		for dir in dirnames:
-			if not include_file(dir):
-				excl_dir.append(dir)
-				continue
-			abspath = os_path.join(dirname, dir)
-			paths.append(abspath)
-		
-		for file in fnames:
-			if not include_file(file):
-				continue
-			abspath = os_path.join(dirname, file)
-			paths.append(abspath)
-
-		for dir in reversed(excl_dir):
-			dirnames.remove(dir)
-
-	return paths
+	return list(dircrawler.crawl(folder, depth=depth, include=include,
+	                             exclude=exclude))
 
 def locale_sort(seq, key=unicode):
 	"""Return @seq of objects with @key function as a list sorted
@@ -79,6 +49,33 @@ def locale_sort(seq, key=unicode):
 	seq.sort(cmp=locale_cmp)
 	return seq
 
+def locale_bisect(seq, item, key=unicode):
+	"""Return the index where to insert @item in @seq, a list sorted
+	with locale_sort, after any items that compare equal to it
+
+	>>> locale.setlocale(locale.LC_ALL, "C")
+	'C'
+	>>> locale_bisect(['A', 'B', 'C', 'a', 'b', 'c'], 'b')
+	5
+	>>> seq = locale_sort("abcABC")
+	>>> locale_insort(seq, 'B')
+	>>> seq
+	['A', 'B', 'B', 'C', 'a', 'b', 'c']
+	"""
+	item_key = key(item)
+	lo, hi = 0, len(seq)
+	while lo < hi:
+		mid = (lo + hi) // 2
+		if locale.strcoll(item_key, key(seq[mid])) < 0:
+			hi = mid
+		else:
+			lo = mid + 1
+	return lo
+
+def locale_insort(seq, item, key=unicode):
+	"""Insert @item into @seq, a list sorted with locale_sort"""
+	seq.insert(locale_bisect(seq, item, key), item)
+
 def _argv_to_locale(argv):
 	"encode unicode strings in @argv according to the locale encoding"
 	return [kupferstring.tolocale(A) if isinstance(A, unicode) else A